@@ -0,0 +1,89 @@
+import os
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+from data_utils import augment_grid,gather_grid,scatter_grid
+
+
+""" Adversarial warm start: reuse each sample's last perturbation in the next epoch """
+
+class AdvCache:
+    """
+    Last perturbation of every training sample, indexed by dataset index.
+    int8 stores delta/eps quantized to 127 levels (1 byte per pixel), fp16 stores delta.
+    With path the store is a memory-mapped .npy, so it survives restarts and need not fit in RAM.
+    """
+    def __init__(self,n,eps,dtype='int8',path=None):
+        assert dtype in ['int8','fp16']
+        self.n,self.eps,self.path=n,eps,path
+        self.dtype=np.int8 if dtype=='int8' else np.float16
+        self.store=None
+        self.seen=np.zeros(n,dtype=bool)
+
+    def _alloc(self,shape):
+        shape=(self.n,)+tuple(shape)
+        if self.path is None: self.store=np.zeros(shape,dtype=self.dtype); return
+        if os.path.isfile(self.path):
+            store=np.load(self.path,mmap_mode='r+')
+            if store.shape==shape and store.dtype==self.dtype:
+                self.store=store
+                self.seen[:]=np.abs(store.reshape(self.n,-1)).max(1)>0
+                return
+        self.store=np.lib.format.open_memmap(self.path,mode='w+',dtype=self.dtype,shape=shape)
+
+    def get(self,index,x):
+        """cached delta for index (zeros for unseen samples) and the seen mask"""
+        if self.store is None: self._alloc(x.shape[1:])
+        index=index.cpu().numpy()
+        delta=torch.from_numpy(self.store[index].astype(np.float32)).to(x.device)
+        if self.dtype==np.int8: delta.mul_(self.eps/127)
+        return delta,torch.from_numpy(self.seen[index]).to(x.device)
+
+    def put(self,index,delta):
+        index=index.cpu().numpy()
+        if self.dtype==np.int8: delta=(delta/self.eps*127).round().clamp(-127,127)
+        self.store[index]=delta.detach().cpu().numpy().astype(self.dtype)
+        self.seen[index]=True
+
+    def flush(self):
+        if isinstance(self.store,np.memmap): self.store.flush()
+
+class WarmPGD:
+    """
+    L_inf PGD on the CE of model(x) (as torchattacks.PGD) started from the cached perturbation.
+    Samples seen before run `steps` iterations, a batch containing unseen samples runs
+    `cold_steps` from a random start, like the plain attack.
+    With crop (augmented datasets) the loader yields the stored images and augment() crops and
+    flips the batch; the cache keeps deltas in the stored image's frame and __call__ maps them
+    through the batch's grid, so a warm start lines up with the pixels it was computed on.
+    """
+    def __init__(self,model,cache,eps,steps=2,cold_steps=20,alpha=None,crop=None,flip=True):
+        self.model,self.cache,self.eps=model,cache,eps
+        self.steps,self.cold_steps,self.alpha=steps,cold_steps,alpha
+        self.crop,self.flip=crop,flip
+
+    def augment(self,x):
+        """random crop/flip of the batch x, and the grid to pass to __call__"""
+        if self.crop is None: return x,None
+        grid=augment_grid(x.shape[0],x.shape[2],x.shape[3],self.crop,self.flip,x.device)
+        return gather_grid(x,grid,self.crop),grid
+
+    def __call__(self,x,y,index,grid=None):
+        """x: augmented batch, grid: its augment() grid"""
+        stored,seen=self.cache.get(index,x)
+        delta=stored if grid is None else gather_grid(stored,grid,self.crop)
+        cold=~seen
+        if cold.any(): # random start for samples without history
+            delta[cold]=torch.empty_like(delta[cold]).uniform_(-self.eps,self.eps)
+        steps=self.steps if seen.all() else self.cold_steps
+        alpha=2.5*self.eps/steps if self.alpha is None else self.alpha
+        delta=((x+delta).clamp(0,1)-x).detach()
+        for _ in range(steps):
+            delta.requires_grad_(True)
+            loss=F.cross_entropy(self.model(x+delta),y)
+            grad,=torch.autograd.grad(loss,delta)
+            delta=(delta.detach()+alpha*grad.sign()).clamp(-self.eps,self.eps)
+            delta=((x+delta).clamp(0,1)-x).detach()
+        self.cache.put(index,delta if grid is None else scatter_grid(stored,delta,grid,self.crop))
+        return (x+delta).detach()
@@ -0,0 +1,67 @@
+import torch
+from AT.cache import AdvCache,WarmPGD
+from profiling import prof
+
+
+""" Cheap adversarial training: the perturbation rides on backward passes we already pay for """
+
+class FreeAT:
+    """
+    Free adversarial training (Shafahi et al., "Adversarial Training for Free!", 2019).
+    Each minibatch is replayed `replays` times; the single backward pass of every replay
+    gives both the weight gradient (SGD step) and the input gradient (FGSM step on delta).
+    delta is carried over to the next minibatch as in the paper.
+    """
+    def __init__(self,eps,replays=4):
+        self.eps,self.replays=eps,replays
+        self.delta=None
+
+    def _delta(self,x):
+        if self.delta is None or self.delta.shape[1:]!=x.shape[1:] or len(self.delta)<len(x):
+            self.delta=torch.zeros_like(x)
+        return self.delta[:len(x)]
+
+    def train_step(self,model,optimizer,x,loss_fn):
+        """loss_fn(x_adv) -> (output, loss, output_adv), as trainer.loss_helper"""
+        for _ in range(self.replays):
+            delta=self._delta(x)
+            x_adv=(x+delta).clamp(0,1).requires_grad_(True)
+            out=loss_fn(x_adv)
+            optimizer.zero_grad()
+            with prof.phase('backward'): out[1].backward()
+            with prof.phase('step'): optimizer.step()
+            self.delta[:len(x)]=(delta+self.eps*x_adv.grad.sign()).clamp(-self.eps,self.eps)
+        return out
+
+class FastAT:
+    """
+    Fast adversarial training (Wong et al., "Fast is better than free", 2020): FGSM from a
+    uniform random start with step alpha=1.25*eps, i.e. two forward/backward passes per
+    step instead of steps+1 for PGD.
+    """
+    def __init__(self,eps,alpha=None):
+        self.eps=eps
+        self.alpha=1.25*eps if alpha is None else alpha
+
+    def train_step(self,model,optimizer,x,loss_fn):
+        delta=torch.empty_like(x).uniform_(-self.eps,self.eps)
+        x_adv=(x+delta).clamp(0,1).requires_grad_(True)
+        loss=loss_fn(x_adv)[1]
+        with prof.phase('attack'):
+            grad,=torch.autograd.grad(loss,x_adv)
+            delta=(delta+self.alpha*grad.sign()).clamp(-self.eps,self.eps)
+        out=loss_fn((x+delta).clamp(0,1).detach())
+        optimizer.zero_grad()
+        with prof.phase('backward'): out[1].backward()
+        with prof.phase('step'): optimizer.step()
+        return out
+
+def at_helper(args,model=None,n=None,path=None):
+    assert args.at_mode in ['pgd','free','fast','cache']
+    if args.at_mode=='free': return FreeAT(args.eps,args.replays)
+    elif args.at_mode=='fast': return FastAT(args.eps)
+    elif args.at_mode=='cache': # n: training set size
+        cache=AdvCache(n,args.eps,args.cache_dtype,path)
+        crop=4 if args.dataset=='cifar' else None # the loader leaves crop/flip to WarmPGD.augment
+        return WarmPGD(model,cache,args.eps,args.cache_steps,crop=crop)
+    return None # full torchattacks attack every step
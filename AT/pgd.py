@@ -0,0 +1,93 @@
+import torch
+import torch.nn.functional as F
+
+
+""" Native PGD: several eps budgets attacked as one stacked batch """
+
+class BatchedPGD:
+    """
+    PGD (Linf or L2) for any model whose forward(x) gives pred and, for PL models,
+    forward(x,True) gives (pred, distance, embedding).
+    objective:
+        'ce': cross entropy on pred, as torchattacks
+        'distance': prototype margin d_y - min_{k!=y} d_k on the distance head
+    All eps in `eps` are run together on a (E*B) stacked batch. Random start is on by default,
+    as torchattacks.PGD; without it the step-0 gradient is the same for every eps, so it is
+    taken once from the clean forward, which also gives the clean prediction.
+    """
+    def __init__(self,model,eps,alpha=2/255,steps=20,norm='Linf',objective='ce',random_start=True):
+        assert norm in ['Linf','L2'] and objective in ['ce','distance']
+        assert objective=='ce' or hasattr(getattr(model,'model',model),'pl'), \
+            "objective 'distance' needs a PLmodel (pred, distance, x) output" # TracedModel keeps it as .model
+        self.model=model
+        self.eps=list(eps) if isinstance(eps,(list,tuple)) else [eps]
+        self.alpha,self.steps=alpha,steps
+        self.norm,self.objective,self.random_start=norm,objective,random_start
+
+    def _loss(self,x,y):
+        if self.objective=='ce':
+            pred=self.model(x)
+            return F.cross_entropy(pred,y,reduction='sum'),pred
+        pred,distance,_=self.model(x,True)
+        pos=distance.gather(1,y[:,None]).squeeze(1)
+        neg=distance.scatter(1,y[:,None],float('inf')).min(1)[0]
+        return (pos-neg).sum(),pred
+
+    def _grad(self,x,y):
+        x=x.clone().requires_grad_(True)
+        loss,pred=self._loss(x,y)
+        grad,=torch.autograd.grad(loss,x)
+        return grad,pred.detach()
+
+    def _step(self,delta,grad,eps):
+        if self.norm=='Linf': return (delta+self.alpha*grad.sign()).clamp(-eps,eps) # eps broadcasts per row
+        g=grad.flatten(1).norm(dim=1).clamp_min(1e-12).view(-1,*[1]*(grad.dim()-1))
+        delta=delta+self.alpha*grad/g
+        d=delta.flatten(1).norm(dim=1).view_as(g)
+        return delta*torch.min(torch.ones_like(d),eps/d.clamp_min(1e-12))
+
+    def perturb(self,x,y):
+        """adversarial inputs of shape (E,B,...) for the E budgets, and the clean prediction"""
+        E,B=len(self.eps),x.size(0)
+        shape=(-1,)+(1,)*(x.dim()-1)
+        eps=torch.tensor(self.eps,device=x.device,dtype=x.dtype).repeat_interleave(B).view(shape)
+        xs,ys=x.repeat(E,*[1]*(x.dim()-1)),y.repeat(E)
+        steps=self.steps
+        if self.random_start:
+            with torch.no_grad(): clean=self.model(x)
+            if self.norm=='Linf': delta=(torch.rand_like(xs)*2-1)*eps
+            else:
+                delta=torch.randn_like(xs)
+                delta=delta/delta.flatten(1).norm(dim=1).view(shape)*eps*torch.rand(E*B,device=x.device).view(shape)
+        else: # step 0 from the clean forward, shared by all budgets
+            grad,clean=self._grad(x,y)
+            delta=self._step(torch.zeros_like(xs),grad.repeat(E,*[1]*(x.dim()-1)),eps)
+            steps-=1
+        delta=(xs+delta).clamp(0,1)-xs
+        for _ in range(steps):
+            grad,_=self._grad(xs+delta,ys)
+            delta=self._step(delta,grad,eps)
+            delta=(xs+delta).clamp(0,1)-xs
+        return (xs+delta).view(E,*x.shape),clean
+
+    def __call__(self,x,y):
+        """torchattacks-style call, adversarial inputs for the first budget"""
+        return self.perturb(x,y)[0][0]
+
+    def evaluate(self,x,y):
+        """number of correct predictions on clean inputs and under each budget"""
+        x_adv,clean=self.perturb(x,y)
+        with torch.no_grad(): pred=self.model(x_adv.flatten(0,1))
+        robust=(pred.argmax(1)==y.repeat(len(self.eps))).view(len(self.eps),-1).sum(1)
+        return (clean.argmax(1)==y).sum().item(),robust.tolist()
+
+    def robustness(self,loader):
+        """clean accuracy and {eps: robust accuracy} over a loader, one attack invocation per batch"""
+        self.model.eval()
+        device=next(self.model.parameters()).device
+        total,clean,robust=0,0,[0]*len(self.eps)
+        for input,target in loader:
+            c,r=self.evaluate(input.to(device),target.to(device))
+            total+=target.size(0); clean+=c
+            robust=[a+b for a,b in zip(robust,r)]
+        return 100*clean/total,{e:100*r/total for e,r in zip(self.eps,robust)}
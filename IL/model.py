@@ -1,4 +1,4 @@
-import torch,os
+import torch,os,time
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
@@ -9,6 +9,8 @@ from PIL import Image
 
 from IL.resnet import resnet18
 from pytorch_metric_learning import distances
+from profiling import prof
+from data_utils import PKBatchSampler
 
 
 def save_checkpoint(state, filename): torch.save(state, filename)
@@ -155,21 +157,25 @@ class iCaRLNet(ILBase):
         if not os.path.exists(save_dir): os.makedirs(save_dir)
         optimizer = self.optimizer
         for epoch in range(args.start_epoch,num_epochs):
+            prof.epoch(epoch)
+            t_data=time.perf_counter_ns()
             for i, (indices, images, labels) in enumerate(loader):
+                prof.record('data',t_data,time.perf_counter_ns())
                 images = Variable(images).cuda()
                 labels = Variable(labels).cuda()
                 indices = indices.cuda()
 
                 optimizer.zero_grad()
-                pred = self.forward(images)
-                loss=self.icarl_loss(pred,labels,q,indices)
+                with prof.phase('forward'): pred = self.forward(images)
+                with prof.phase('loss'): loss=self.icarl_loss(pred,labels,q,indices)
                 if args.AT and attack is not None:
-                    images_adv = attack(images, labels)
-                    pred_adv = self.forward(images_adv)
-                    loss+=self.cls_loss(pred_adv, labels)
+                    with prof.phase('attack'): images_adv = attack(images, labels)
+                    with prof.phase('forward'): pred_adv = self.forward(images_adv)
+                    with prof.phase('loss'): loss+=self.cls_loss(pred_adv, labels)
 
-                loss.backward()
-                optimizer.step()
+                with prof.phase('backward'): loss.backward()
+                with prof.phase('step'): optimizer.step()
+                t_data=time.perf_counter_ns()
                 if (i+1) % 100 == 0:
                     print('Epoch [{:d}/{:d}], Iter [{:d}/{:d}] Loss: {:.4f}' 
                            .format(epoch+1, num_epochs, i+1, 
@@ -243,21 +249,25 @@ class DCENet(ILBase):
         if not os.path.exists(save_dir): os.makedirs(save_dir)
         optimizer = self.optimizer
         for epoch in range(args.start_epoch,num_epochs):
+            prof.epoch(epoch)
+            t_data=time.perf_counter_ns()
             for i, (indices, images, labels) in enumerate(loader):
+                prof.record('data',t_data,time.perf_counter_ns())
                 images = Variable(images).cuda()
                 labels = Variable(labels).cuda()
                 indices = indices.cuda()
 
                 optimizer.zero_grad()
                 if args.AT and attack is not None:
-                    images_adv = attack(images, labels)
+                    with prof.phase('attack'): images_adv = attack(images, labels)
                     images = torch.cat((images, images_adv), dim=0)
                     labels=torch.cat((labels, labels), dim=0)
-                features, centers, output= self.forward(images,True)
-                loss=self.loss(output,labels,features,centers) 
+                with prof.phase('forward'): features, centers, output= self.forward(images,True)
+                with prof.phase('loss'): loss=self.loss(output,labels,features,centers) 
 
-                loss.backward()
-                optimizer.step()
+                with prof.phase('backward'): loss.backward()
+                with prof.phase('step'): optimizer.step()
+                t_data=time.perf_counter_ns()
                 if (i+1) % 100 == 0:
                     print('Epoch [{:d}/{:d}], Iter [{:d}/{:d}] Loss: {:.4f}' 
                            .format(epoch+1, num_epochs, i+1, 
@@ -323,8 +333,12 @@ class MLNet(ILBase):
         print(len(new_classes),"new classes")
         # Form combined training set
         self.combine_dataset_with_exemplars(dataset)
-        loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size,
-                                               shuffle=True, num_workers=num_workers)
+        if getattr(args,'pk_classes',0): # P x K class-balanced batches over new classes and exemplars
+            sampler=PKBatchSampler(dataset.train_labels,args.pk_classes,args.pk_samples)
+            loader = torch.utils.data.DataLoader(dataset, batch_sampler=sampler, num_workers=num_workers)
+        else:
+            loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size,
+                                                   shuffle=True, num_workers=num_workers)
 
         # Run network training
         save_dir=os.path.join(args.save_dir, args.group+'_IL')
@@ -332,21 +346,26 @@ class MLNet(ILBase):
         if not os.path.exists(save_dir): os.makedirs(save_dir)
         optimizer = self.optimizer
         for epoch in range(args.start_epoch,num_epochs):
+            prof.epoch(epoch)
+            if isinstance(loader.batch_sampler,PKBatchSampler): loader.batch_sampler.set_epoch(epoch)
+            t_data=time.perf_counter_ns()
             for i, (indices, images, labels) in enumerate(loader):
+                prof.record('data',t_data,time.perf_counter_ns())
                 images = images.cuda()
                 labels = labels.cuda()
                 indices = indices.cuda()
 
                 optimizer.zero_grad()
                 if args.AT and attack is not None:
-                    images_adv = attack(images, labels)
+                    with prof.phase('attack'): images_adv = attack(images, labels)
                     images = torch.cat((images, images_adv), dim=0)
                     labels=torch.cat((labels, labels), dim=0)
-                output, embeds= self.forward(images,True)
-                loss=self.loss(output,embeds,labels)
+                with prof.phase('forward'): output, embeds= self.forward(images,True)
+                with prof.phase('loss'): loss=self.loss(output,embeds,labels)
                 
-                loss.backward()
-                optimizer.step()
+                with prof.phase('backward'): loss.backward()
+                with prof.phase('step'): optimizer.step()
+                t_data=time.perf_counter_ns()
                 if (i+1) % 100 == 0:
                     print('Epoch [{:d}/{:d}], Iter [{:d}/{:d}] Loss: {:.4f}' 
                            .format(epoch+1, num_epochs, i+1, 
@@ -412,21 +431,25 @@ class PLNet(ILBase):
         if not os.path.exists(save_dir): os.makedirs(save_dir)
         optimizer = self.optimizer
         for epoch in range(args.start_epoch,num_epochs):
+            prof.epoch(epoch)
+            t_data=time.perf_counter_ns()
             for i, (indices, images, labels) in enumerate(loader):
+                prof.record('data',t_data,time.perf_counter_ns())
                 images = Variable(images).cuda()
                 labels = Variable(labels).cuda()
                 indices = indices.cuda()
 
                 optimizer.zero_grad()
                 if args.AT and attack is not None:
-                    images_adv = attack(images, labels)
+                    with prof.phase('attack'): images_adv = attack(images, labels)
                     images = torch.cat((images, images_adv), dim=0)
                     labels=torch.cat((labels, labels), dim=0)
-                _, distance, x= self.forward(images,True)
-                loss=self.loss(x,distance,labels)
+                with prof.phase('forward'): _, distance, x= self.forward(images,True)
+                with prof.phase('loss'): loss=self.loss(x,distance,labels)
 
-                loss.backward()
-                optimizer.step()
+                with prof.phase('backward'): loss.backward()
+                with prof.phase('step'): optimizer.step()
+                t_data=time.perf_counter_ns()
                 if (i+1) % 100 == 0:
                     print('Epoch [{:d}/{:d}], Iter [{:d}/{:d}] Loss: {:.4f}' 
                            .format(epoch+1, num_epochs, i+1, 
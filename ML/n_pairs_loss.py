@@ -8,8 +8,15 @@ from pytorch_metric_learning.utils import common_functions as c_f
 
 
 class NPairsLoss(BaseMetricLossFunction):
-    def __init__(self, **kwargs):
+    """
+    Args:
+        memory: optional ML.xbm.CrossBatchMemory; the embeddings of earlier batches with a
+                label other than the anchor's are added to its negatives
+    """
+
+    def __init__(self, memory=None, **kwargs):
         super().__init__(**kwargs)
+        self.memory = memory
         self.add_to_recordable_attributes(name="num_pairs", is_stat=True)
         self.cross_entropy = torch.nn.CrossEntropyLoss(reduction="none")
 
@@ -23,6 +30,14 @@ class NPairsLoss(BaseMetricLossFunction):
         anchors, positives = embeddings[anchor_idx], embeddings[positive_idx]
         targets = c_f.to_device(torch.arange(self.num_pairs), embeddings)
         sim_mat = self.distance(anchors, positives)
+        if self.memory is not None and self.memory.filled:
+            mem_emb, mem_labels = self.memory.get()
+            mem_mat = self.distance(anchors, mem_emb)
+            mem_mat = mem_mat.masked_fill(
+                labels[anchor_idx][:, None] == mem_labels[None],
+                float("-inf") if self.distance.is_inverted else float("inf"),
+            )
+            sim_mat = torch.cat((sim_mat, mem_mat), 1)
         if not self.distance.is_inverted:
             sim_mat = -sim_mat
         return {
@@ -50,6 +65,8 @@ class NPairsLoss(BaseMetricLossFunction):
         c_f.check_shapes(embeddings, labels)
         labels = c_f.to_device(labels, embeddings)
         loss_dict = self.compute_loss(embeddings, labels, indices_tuple)
+        if self.memory is not None and self.training:
+            self.memory.enqueue(embeddings, labels)
         length=len(loss_dict['loss']['losses'])
         l2norm=torch.norm(embeddings[loss_dict['loss']['indices']],2)/length
         self.add_embedding_regularization_to_loss_dict(loss_dict, embeddings)
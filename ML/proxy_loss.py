@@ -0,0 +1,52 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from vision_models import PL, pl_loss
+
+
+class ProxyLoss(nn.Module):
+    """
+    Proxy-based metric loss on the prototype matrix of a vision_models.PL (C proxies per
+    class, averaged per class like PL.pred), O(B*K) and without pair mining. On the
+    similarities s (the PL loss distance, negated unless it is a similarity) scaled by alpha:
+        mode "nca": Proxy-NCA, pl_loss(-alpha*s), i.e. log(1+sum_neg exp(alpha*(s_neg-s_pos)))
+        mode "anchor": Proxy-Anchor, every proxy with positives in the batch pulls them in
+                       log(1+sum_pos exp(-alpha*(s-delta))) averaged over those proxies, every
+                       proxy pushes its negatives log(1+sum_neg exp(alpha*(s+delta))) / K
+    Args:
+        K: number of classes, D: embedding size, C: proxies per class
+        dist: dist_helper name, 'dotproduct' (normalized, cosine) suits the default alpha
+    Called like the TLA/NLA losses: loss(embeddings, labels, a, b).
+    """
+
+    def __init__(self, K=10, D=64, C=1, mode="anchor", dist="dotproduct", alpha=32, delta=0.1):
+        assert mode in ["nca", "anchor"]
+        super().__init__()
+        self.pl = PL(C, D, dist, dist, dist, K)
+        self.mode, self.alpha, self.delta = mode, alpha, delta
+
+    def similarity(self, embeddings):
+        pl = self.pl
+        mat = pl.loss_dist(embeddings, pl.embeds)
+        if not pl.loss_dist.is_inverted:
+            mat = -mat
+        return mat.reshape(-1, pl.C, pl.K).mean(1)
+
+    def compute_loss(self, embeddings, labels):
+        s = self.similarity(embeddings)
+        y = F.one_hot(labels, num_classes=self.pl.K)
+        if self.mode == "nca":
+            return pl_loss(y, -self.alpha * s, self.pl.K)
+        pos = y.bool()
+        pos_sum = torch.where(pos, torch.exp(-self.alpha * (s - self.delta)), torch.zeros_like(s)).sum(0)
+        neg_sum = torch.where(pos, torch.zeros_like(s), torch.exp(self.alpha * (s + self.delta))).sum(0)
+        with_pos = pos.any(0)
+        pos_term = torch.log1p(pos_sum[with_pos]).sum() / with_pos.sum()
+        neg_term = torch.log1p(neg_sum).sum() / self.pl.K
+        return pos_term + neg_term
+
+    def forward(self, embeddings, labels, a, b):
+        labels = labels.to(embeddings.device)
+        l2norm = torch.norm(embeddings, 2) / len(embeddings)
+        return a * self.compute_loss(embeddings, labels) + b * l2norm
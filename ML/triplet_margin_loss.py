@@ -14,6 +14,14 @@ class TripletMarginLoss(BaseMetricLossFunction):
         swap: Use the positive-negative distance instead of anchor-negative distance,
               if it violates the margin more.
         smooth_loss: Use the log-exp version of the triplet loss
+        mining: "all" enumerates triplets (triplets_per_anchor of them per anchor),
+                "batch_hard" takes the hardest positive and negative of every anchor,
+                "semi_hard" the closest negative beyond the positive for every
+                anchor-positive pair (the farthest negative if there is none); both
+                mine on the B x B distance matrix with masks, O(B^2) memory
+        memory: optional ML.xbm.CrossBatchMemory; positives and negatives are then also
+                mined from the embeddings of earlier batches (B x (B+M) distance matrix),
+                needs batch_hard or semi_hard mining
     """
 
     def __init__(
@@ -22,26 +30,42 @@ class TripletMarginLoss(BaseMetricLossFunction):
         swap=False,
         smooth_loss=False,
         triplets_per_anchor="all",
+        mining="all",
+        memory=None,
         **kwargs
     ):
+        assert mining in ["all", "batch_hard", "semi_hard"]
+        if memory is not None and mining == "all":
+            raise ValueError("cross-batch memory needs batch_hard or semi_hard mining")
         super().__init__(**kwargs)
         self.margin = margin
         self.swap = swap
         self.smooth_loss = smooth_loss
         self.triplets_per_anchor = triplets_per_anchor
+        self.mining = mining
+        self.memory = memory
         self.add_to_recordable_attributes(list_of_names=["margin"], is_stat=False)
 
-    def compute_loss(self, embeddings, labels, indices_tuple):
-        indices_tuple = lmu.convert_to_triplets(
-            indices_tuple, labels, t_per_anchor=self.triplets_per_anchor
-        )
+    def compute_loss(self, embeddings, labels, indices_tuple, ref_emb=None, ref_labels=None):
+        """ref_emb, ref_labels: the batch followed by the memory, mined as positives / negatives"""
+        if ref_emb is None:
+            ref_emb, ref_labels = embeddings, labels
+        mat = self.distance(embeddings, ref_emb)
+        if self.mining != "all" and indices_tuple is None:
+            indices_tuple = self.mine(mat, labels, ref_labels)
+        else:
+            indices_tuple = lmu.convert_to_triplets(
+                indices_tuple, labels, t_per_anchor=self.triplets_per_anchor
+            )
         anchor_idx, positive_idx, negative_idx = indices_tuple
         if len(anchor_idx) == 0:
             return self.zero_losses()
-        mat = self.distance(embeddings)
         ap_dists = mat[anchor_idx, positive_idx]
         an_dists = mat[anchor_idx, negative_idx]
-        if self.swap:
+        if self.swap and ref_emb is not embeddings:
+            pn_dists = self.distance.pairwise_distance(ref_emb[positive_idx], ref_emb[negative_idx])
+            an_dists = self.distance.smallest_dist(an_dists, pn_dists)
+        elif self.swap:
             pn_dists = mat[positive_idx, negative_idx]
             an_dists = self.distance.smallest_dist(an_dists, pn_dists)
 
@@ -60,6 +84,29 @@ class TripletMarginLoss(BaseMetricLossFunction):
             }
         }
 
+    def mine(self, mat, labels, ref_labels=None):
+        """(anchor, positive, negative) indices picked from the B x N distance matrix, N >= B"""
+        if ref_labels is None:
+            ref_labels = labels
+        with torch.no_grad():
+            d = -mat if self.distance.is_inverted else mat # larger is farther
+            same = labels[:, None] == ref_labels[None]
+            pos_mask = same & ~torch.eye(*mat.shape, dtype=torch.bool, device=mat.device)
+            neg_mask = ~same
+            has_neg = neg_mask.any(1)
+            if self.mining == "batch_hard":
+                anchor_idx = torch.where(pos_mask.any(1) & has_neg)[0]
+                positive_idx = d.masked_fill(~pos_mask, -float("inf")).argmax(1)[anchor_idx]
+                negative_idx = d.masked_fill(~neg_mask, float("inf")).argmin(1)[anchor_idx]
+                return anchor_idx, positive_idx, negative_idx
+            anchor_idx, positive_idx = torch.where(pos_mask & has_neg[:, None])
+            neg_d, order = d.masked_fill(~neg_mask, float("inf")).sort(1)
+            # per anchor row, the first negative farther than each column's distance
+            first = torch.searchsorted(neg_d, d.contiguous(), right=True)[anchor_idx, positive_idx]
+            last = neg_mask.sum(1)[anchor_idx] - 1
+            k = torch.where(first <= last, first, last)
+            return anchor_idx, positive_idx, order[anchor_idx, k]
+
     def get_default_reducer(self):
         return AvgNonZeroReducer()
 
@@ -76,13 +123,23 @@ class TripletMarginLoss(BaseMetricLossFunction):
         self.reset_stats()
         c_f.check_shapes(embeddings, labels)
         labels = c_f.to_device(labels, embeddings)
-        loss_dict = self.compute_loss(embeddings, labels, indices_tuple)
+        ref_emb, ref_labels = embeddings, labels
+        if self.memory is not None:
+            mem_emb, mem_labels = self.memory.get()
+            ref_emb, ref_labels = torch.cat((embeddings, mem_emb)), torch.cat((labels, mem_labels))
+        loss_dict = self.compute_loss(embeddings, labels, indices_tuple, ref_emb, ref_labels)
+        if self.memory is not None and self.training:
+            self.memory.enqueue(embeddings, labels)
         l2norm=0
         length=len(loss_dict['loss']['losses'])
-        l2norm+=torch.norm(embeddings[loss_dict['loss']['indices'][0]],2)
-        l2norm+=torch.norm(embeddings[loss_dict['loss']['indices'][1]],2)
-        l2norm+=torch.norm(embeddings[loss_dict['loss']['indices'][2]],2)
+        for idx in loss_dict['loss']['indices']: l2norm+=gathered_norm(ref_emb,idx)
         l2norm=l2norm/length
         self.add_embedding_regularization_to_loss_dict(loss_dict, embeddings)
         mlloss=self.reducer(loss_dict, embeddings, labels)
-        return a*mlloss+b*l2norm
\ No newline at end of file
+        return a*mlloss+b*l2norm
+
+
+def gathered_norm(embeddings, idx):
+    """torch.norm(embeddings[idx]) from per-row counts, without the gathered copy"""
+    counts = torch.bincount(idx, minlength=len(embeddings)).to(embeddings.dtype)
+    return torch.sqrt(counts @ embeddings.pow(2).sum(1))
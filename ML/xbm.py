@@ -0,0 +1,40 @@
+import torch
+
+
+class CrossBatchMemory(torch.nn.Module):
+    """
+    FIFO queue of the last `size` detached embeddings and their labels, for mining pairs
+    across batches (XBM). The queue is a ring buffer preallocated on the embeddings' device
+    at the first enqueue; enqueue overwrites the oldest rows in place. The buffers are not
+    persistent, so checkpoints are unchanged and a resumed run starts with an empty memory.
+    Args:
+        size: number of embeddings kept
+    """
+
+    def __init__(self, size):
+        super().__init__()
+        self.size = size
+        self.register_buffer("embeddings", torch.zeros(0), persistent=False)
+        self.register_buffer("labels", torch.zeros(0, dtype=torch.long), persistent=False)
+        self.ptr = self.filled = 0
+
+    def reset(self):
+        self.ptr = self.filled = 0
+
+    def get(self):
+        """(embeddings, labels) currently in the memory, in ring order"""
+        return self.embeddings[: self.filled], self.labels[: self.filled]
+
+    def enqueue(self, embeddings, labels):
+        embeddings, labels = embeddings.detach(), labels.detach()
+        if self.embeddings.shape != (self.size, embeddings.shape[1]) or self.embeddings.device != embeddings.device:
+            self.embeddings = embeddings.new_zeros(self.size, embeddings.shape[1])
+            self.labels = labels.new_zeros(self.size)
+            self.reset()
+        if len(embeddings) > self.size:
+            embeddings, labels = embeddings[-self.size :], labels[-self.size :]
+        idx = (self.ptr + torch.arange(len(embeddings), device=embeddings.device)) % self.size
+        self.embeddings.index_copy_(0, idx, embeddings.to(self.embeddings.dtype))
+        self.labels.index_copy_(0, idx, labels)
+        self.ptr = (self.ptr + len(embeddings)) % self.size
+        self.filled = min(self.filled + len(embeddings), self.size)
@@ -35,7 +35,7 @@ criterion = nn.CrossEntropyLoss()
 
 
 
-def testood(name, net1, dataName, num_workers, indis, CUDA_DEVICE=0, epsilon=0.0014, temperature=1000):
+def testood(name, net1, dataName, num_workers, indis, CUDA_DEVICE=0, epsilon=0.0014, temperature=1000, ret_scores=False):
     
     assert dataName in ["Imagenet","Imagenet_resize","LSUN","LSUN_resize",
                     "iSUN","Gaussian","Uniform","cifar","svhn"]
@@ -72,7 +72,7 @@ def testood(name, net1, dataName, num_workers, indis, CUDA_DEVICE=0, epsilon=0.0
     if dataName == "Gaussian": d.testGaussian(path, net1, criterion, CUDA_DEVICE, testloaderIn, testloaderIn, dataName, epsilon, temperature)
     elif dataName == "Uniform": d.testUni(path, net1, criterion, CUDA_DEVICE, testloaderIn, testloaderIn, dataName, epsilon, temperature)
     else: d.testData(path, net1, criterion, CUDA_DEVICE, testloaderIn, testloaderOut, dataName, epsilon, temperature) 
-    return m.metric(path, indis, dataName)
+    return m.metric(path, indis, dataName, ret_scores)
 
 
 
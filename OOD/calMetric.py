@@ -299,7 +299,7 @@ def detection(path,name):
 
 
 
-def metric(path, indis, data):
+def metric(path, indis, data, ret_scores=False):
     # assert indis in ["CIFAR-10","CIFAR-100"]
     
     if data == "Imagenet": dataName = "Tiny-ImageNet (crop)"
@@ -338,6 +338,9 @@ def metric(path, indis, data):
     msg+="{:20}{:13.1f}%".format("AUROC:",aurocBase*100)+'\n'
     msg+="{:20}{:13.1f}%".format("AUPR In:",auprinBase*100)+'\n'
     msg+="{:20}{:13.1f}%".format("AUPR Out:",auproutBase*100)+'\n'
+    if ret_scores: # baseline scores in percent, as printed
+        scores={'fpr95':fprBase,'detection_error':errorBase,'auroc':aurocBase,'aupr_in':auprinBase,'aupr_out':auproutBase}
+        return msg,{k:100*float(v) for k,v in scores.items()}
     return msg
 
 
@@ -0,0 +1,65 @@
+import argparse
+import torch
+import torch.nn.functional as F
+
+from common import timeit,table,save_json,build,input_shape
+from compiled import compile_model,TracedModel
+
+
+""" Eager vs torch.compile vs TorchScript trace throughput of the vision models """
+
+def train_step(model,x,y,opt):
+    out=model(x)
+    loss=F.cross_entropy(out,y)
+    opt.zero_grad()
+    loss.backward()
+    opt.step()
+
+def run(args,loss,backbone):
+    torch.manual_seed(0)
+    x=torch.rand(args.batch_size,*input_shape(backbone))
+    y=torch.randint(0,10,(args.batch_size,))
+    rows=[]
+    for variant in ['eager','compile','trace']:
+        model=build(loss,backbone,D=args.D)
+        if variant=='compile': model=compile_model(model,args.mode,fallback=False)
+        if variant!='trace': # train step, on the prediction head
+            opt=torch.optim.SGD(model.parameters(),0.01)
+            model.train()
+            t=timeit(lambda: train_step(model,x,y,opt),args.warmup,args.iters)
+            rows.append({'model':backbone,'loss':loss,'variant':variant,'phase':'train',
+                         'ms':t['p50'],'img/s':args.batch_size/t['p50']*1e3})
+        model.eval()
+        if variant=='trace': model=TracedModel(model)
+        for embed in [False,True]:
+            if loss=='vanilla' and embed: continue
+            def infer():
+                with torch.no_grad(): return model(x,True) if embed else model(x)
+            t=timeit(infer,args.warmup,args.iters)
+            rows.append({'model':backbone,'loss':loss,'variant':variant,'phase':'eval-embed' if embed else 'eval',
+                         'ms':t['p50'],'img/s':args.batch_size/t['p50']*1e3})
+    base={r['phase']:r['ms'] for r in rows if r['variant']=='eager'}
+    for r in rows: r['speedup']=base[r['phase']]/r['ms']
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compiled backbone benchmark (CPU)')
+    parser.add_argument('--models', nargs='+', default=['conv','resnet','vgg','mobilenet'])
+    parser.add_argument('--losses', nargs='+', default=['vanilla','PL'])
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64)
+    parser.add_argument('--D', type=int, default=64)
+    parser.add_argument('--mode', type=str, default='default', help='torch.compile mode')
+    parser.add_argument('--warmup', type=int, default=3, help='also absorbs compilation')
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--out', type=str, default='', help='JSON results')
+    args = parser.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    rows=[]
+    for m in args.models:
+        for l in args.losses: 
+            if l=='vanilla' and m=='conv': continue # ConvNet has no classifier
+            rows+=run(args,l,m)
+    print(table(['model','loss','variant','phase','ms','img/s','speedup'],rows))
+    if args.out: save_json(args.out,rows,batch_size=args.batch_size,mode=args.mode)
@@ -0,0 +1,56 @@
+import argparse
+import torch
+
+from common import timeit,table,save_json,build,input_shape
+from freeze import freeze_model,max_error
+
+
+""" CPU inference latency of eager vs frozen (BN folded, channels_last, TorchScript) models """
+
+def randomize_bn(model):
+    """non-trivial running statistics, as after training"""
+    for m in model.modules():
+        if isinstance(m,torch.nn.BatchNorm2d):
+            m.running_mean.uniform_(-0.5,0.5); m.running_var.uniform_(0.5,2)
+            m.weight.data.uniform_(0.5,1.5); m.bias.data.uniform_(-0.5,0.5)
+    return model
+
+def run(args,loss,backbone):
+    torch.manual_seed(0)
+    x=torch.rand(args.batch_size,*input_shape(backbone))
+    model=randomize_bn(build(loss,backbone,D=args.D)).eval()
+    variants=[('eager',model),
+              ('folded',freeze_model(model,x,jit=False,channels_last=False)),
+              ('folded+cl',freeze_model(model,x,jit=False)),
+              ('frozen-jit',freeze_model(model,x,jit=True))]
+    rows=[]
+    with torch.no_grad(): ref=model(x,True) if hasattr(model,'emb') else model(x)
+    for name,m in variants:
+        def infer():
+            with torch.no_grad(): return m(x,True) if hasattr(model,'emb') else m(x)
+        t=timeit(infer,args.warmup,args.iters)
+        rows.append({'model':backbone,'loss':loss,'variant':name,'ms':t['p50'],
+                     'img/s':args.batch_size/t['p50']*1e3,'error':max_error(ref,infer())})
+    for r in rows: r['speedup']=rows[0]['ms']/r['ms']
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Freeze-for-inference benchmark (CPU)')
+    parser.add_argument('--models', nargs='+', default=['conv','resnet','vgg','mobilenet'])
+    parser.add_argument('--losses', nargs='+', default=['PL'])
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64)
+    parser.add_argument('--D', type=int, default=64)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--out', type=str, default='', help='JSON results')
+    args = parser.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    rows=[]
+    for m in args.models:
+        for l in args.losses: 
+            if l=='vanilla' and m=='conv': continue # ConvNet has no classifier
+            rows+=run(args,l,m)
+    print(table(['model','loss','variant','ms','img/s','speedup','error'],rows))
+    if args.out: save_json(args.out,rows,batch_size=args.batch_size)
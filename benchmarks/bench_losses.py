@@ -0,0 +1,115 @@
+import sys,argparse,itertools
+import torch
+import torch.nn.functional as F
+
+from common import timeit,peak_memory,table,save_json,load_json,regressions
+import vision_models as models
+from ML.triplet_margin_loss import TripletMarginLoss as TML
+from ML.n_pairs_loss import NPairsLoss as NPL
+from ML.xbm import CrossBatchMemory
+from ML.proxy_loss import ProxyLoss
+
+
+""" Micro-benchmarks of the prototype / metric-learning losses with JSON baselines """
+
+# setup(B,K,C,D) -> fn(), fn returns the output to backpropagate
+def pl_pred(B,K,C,D):
+    pl,x=models.PL(C,D,K=K),torch.randn(B,D,requires_grad=True)
+    return lambda: pl.pred(x)[1]
+
+def pl_full_loss(B,K,C,D):
+    pl,x=models.PL(C,D,K=K),torch.randn(B,D,requires_grad=True)
+    y=torch.randint(0,K,(B,))
+    with torch.no_grad(): pred,distance=pl.pred(x)
+    distance.requires_grad_(True)
+    return lambda: pl.loss(pred,x,distance,y)
+
+def pl_loss(B,K,C,D):
+    dist,y=torch.rand(B,K,requires_grad=True),F.one_hot(torch.randint(0,K,(B,)),K)
+    return lambda: models.pl_loss(y,dist,K)
+
+def gather_nd(B,K,C,D):
+    dist,y=torch.rand(B,K,requires_grad=True),F.one_hot(torch.randint(0,K,(B,)),K)
+    return lambda: models.gather_nd(dist,y,0)
+
+def dce_forward(B,K,C,D):
+    dce,x=models.dce_loss(K,D),torch.randn(B,D,requires_grad=True)
+    return lambda: dce(x)[1]
+
+def regularization(B,K,C,D):
+    centers,x=torch.randn(D,K,requires_grad=True),torch.randn(B,D,requires_grad=True)
+    y=torch.randint(0,K,(B,))
+    return lambda: models.regularization(x,centers,y)
+
+def metric_loss(loss,memory=0):
+    def setup(B,K,C,D):
+        x,y=torch.randn(B,D,requires_grad=True),torch.randint(0,K,(B,))
+        if memory: # a full memory of `memory` x batch size
+            loss.memory=CrossBatchMemory(memory*B)
+            loss.memory.enqueue(torch.randn(memory*B,D),torch.randint(0,K,(memory*B,)))
+        return lambda: loss(x,y,0.3,1e-4)
+    return setup
+
+CASES={ # name: (swept sizes, setup), the other sizes are 1
+    'PL.pred':(('B','K','C','D'),pl_pred),
+    'PL.loss':(('B','K','C','D'),pl_full_loss),
+    'pl_loss':(('B','K'),pl_loss),
+    'gather_nd':(('B','K'),gather_nd),
+    'dce_loss':(('B','K','D'),dce_forward),
+    'regularization':(('B','K','D'),regularization),
+    'TML':(('B','K','D'),metric_loss(TML())),
+    'TML-batch_hard':(('B','K','D'),metric_loss(TML(mining='batch_hard'))),
+    'TML-semi_hard':(('B','K','D'),metric_loss(TML(mining='semi_hard'))),
+    'TML-semi_hard-xbm':(('B','K','D'),metric_loss(TML(mining='semi_hard'),memory=8)),
+    'NPL':(('B','K','D'),metric_loss(NPL())),
+    'NPL-xbm':(('B','K','D'),metric_loss(NPL(),memory=8)),
+    'PXA-anchor':(('B','K','C','D'),lambda B,K,C,D: metric_loss(ProxyLoss(K,D,C,'anchor'))(B,K,C,D)),
+    'PXA-nca':(('B','K','C','D'),lambda B,K,C,D: metric_loss(ProxyLoss(K,D,C,'nca'))(B,K,C,D)),
+}
+
+def run(args,name):
+    params,setup=CASES[name]
+    grid={'B':args.B,'K':args.K,'C':args.C,'D':args.D}
+    rows=[]
+    for values in itertools.product(*(grid[p] for p in params)):
+        size=dict({'B':'-','K':'-','C':'-','D':'-'},**dict(zip(params,values)))
+        torch.manual_seed(0)
+        fn=setup(*(size[p] if p in params else 1 for p in 'BKCD'))
+        phases=[('fwd',fn)]
+        if args.backward: phases.append(('fwd+bwd',lambda: fn().sum().backward()))
+        for phase,f in phases:
+            t=timeit(f,args.warmup,args.iters)
+            rows.append(dict(size,loss=name,phase=phase,ms=t['p50'],p90=t['p90'],min=t['min'],MB=peak_memory(f)))
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Loss micro-benchmarks (CPU)')
+    parser.add_argument('--losses', nargs='+', default=list(CASES))
+    parser.add_argument('--B', nargs='+', type=int, default=[64,128], help='batch sizes (TML with mining all is O(B^3))')
+    parser.add_argument('--K', nargs='+', type=int, default=[10,100], help='classes')
+    parser.add_argument('--C', nargs='+', type=int, default=[1,3], help='prototypes per class')
+    parser.add_argument('--D', nargs='+', type=int, default=[64,256], help='embedding sizes')
+    parser.add_argument('--backward', type=int, default=1, help='also time forward+backward')
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iters', type=int, default=20)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--out', type=str, default='', help='JSON results, e.g. a new baseline')
+    parser.add_argument('--baseline', type=str, default='', help='JSON results to compare against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='relative slowdown / memory growth that fails')
+    parser.add_argument('--min-ms', dest='min_ms', type=float, default=1.0,
+                        help='timings below this in either run are not compared (timer noise)')
+    parser.add_argument('--normalize-drift', dest='normalize_drift', type=int, default=0,
+                        help='divide timings by their median ratio to the baseline (a slowdown of most cases then passes)')
+    args = parser.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    rows=[]
+    for name in args.losses: rows+=run(args,name)
+    print(table(['loss','phase','B','K','C','D','ms','p90','min','MB'],rows))
+    if args.out: save_json(args.out,rows,B=args.B,K=args.K,C=args.C,D=args.D)
+    if args.baseline:
+        msgs=regressions(rows,load_json(args.baseline),['loss','phase','B','K','C','D'],['min','MB'],args.threshold,
+                         {'min':args.min_ms},['min'] if args.normalize_drift else []) # the fastest run: p50 shifts with machine load
+        for m in msgs: print('REGRESSION',m)
+        if msgs: sys.exit(1)
+        print('No regressions against',args.baseline)
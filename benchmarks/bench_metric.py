@@ -0,0 +1,79 @@
+import argparse,time
+import torch
+import torch.nn as nn
+
+from common import table,save_json
+from ML.triplet_margin_loss import TripletMarginLoss as TML
+from ML.n_pairs_loss import NPairsLoss as NPL
+from ML.proxy_loss import ProxyLoss
+
+
+""" Speed / quality of the metric losses (TLA, NLA, PXA) training an embedding on synthetic clusters """
+
+LOSSES={
+    'TLA':lambda K,D: TML(),
+    'TLA-batch_hard':lambda K,D: TML(mining='batch_hard'),
+    'TLA-semi_hard':lambda K,D: TML(mining='semi_hard'),
+    'NLA':lambda K,D: NPL(),
+    'PXA-anchor':lambda K,D: ProxyLoss(K,D,mode='anchor'),
+    'PXA-nca':lambda K,D: ProxyLoss(K,D,mode='nca'),
+}
+
+def clusters(n,K,d_in,seed):
+    """n samples (drawn with seed) of K fixed Gaussian clusters, through a fixed nonlinear warp"""
+    g=torch.Generator().manual_seed(0)
+    centers=torch.randn(K,d_in,generator=g)*0.6
+    warp=torch.randn(d_in,d_in,generator=g)/d_in**0.5
+    g.manual_seed(seed+1)
+    y=torch.randint(0,K,(n,),generator=g)
+    x=centers[y]+torch.randn(n,d_in,generator=g)
+    return torch.tanh(x@warp)+0.1*x,y
+
+def recall_at_1(emb,y):
+    """fraction of samples whose nearest other sample (cosine) has the same class"""
+    emb=nn.functional.normalize(emb,dim=1)
+    sim=emb@emb.t()
+    sim.fill_diagonal_(-float('inf'))
+    return (y[sim.argmax(1)]==y).float().mean().item()
+
+def run(args,name):
+    torch.manual_seed(0)
+    x,y=clusters(args.n,args.K,args.d_in,0)
+    xt,yt=clusters(args.n_test,args.K,args.d_in,1)
+    net=nn.Sequential(nn.Linear(args.d_in,256),nn.ReLU(),nn.Linear(256,args.D))
+    loss=LOSSES[name](args.K,args.D)
+    opt=torch.optim.Adam(list(net.parameters())+list(loss.parameters()),args.lr)
+    t,steps=0,0
+    for epoch in range(args.epochs):
+        order=torch.randperm(len(x))
+        for i in range(0,len(x)-args.batch_size+1,args.batch_size):
+            idx=order[i:i+args.batch_size]
+            start=time.perf_counter()
+            l=loss(net(x[idx]),y[idx],1,0)
+            opt.zero_grad()
+            l.backward()
+            opt.step()
+            t+=time.perf_counter()-start
+            steps+=1
+    with torch.no_grad(): r1=recall_at_1(net(xt),yt)
+    return {'loss':name,'B':args.batch_size,'ms/step':1e3*t/steps,'R@1':r1}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Metric loss speed / Recall@1 on synthetic clusters (CPU)')
+    parser.add_argument('--losses', nargs='+', default=list(LOSSES))
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64, help='TLA (mining all) is O(B^3)')
+    parser.add_argument('--K', type=int, default=10, help='classes')
+    parser.add_argument('--D', type=int, default=64, help='embedding size')
+    parser.add_argument('--d-in', dest='d_in', type=int, default=32)
+    parser.add_argument('--n', type=int, default=4096, help='training samples')
+    parser.add_argument('--n-test', dest='n_test', type=int, default=2048)
+    parser.add_argument('--epochs', type=int, default=5)
+    parser.add_argument('--lr', type=float, default=1e-3)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--out', type=str, default='', help='JSON results')
+    args = parser.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    rows=[run(args,name) for name in args.losses]
+    print(table(['loss','B','ms/step','R@1'],rows))
+    if args.out: save_json(args.out,rows,batch_size=args.batch_size,K=args.K,D=args.D,n=args.n,epochs=args.epochs)
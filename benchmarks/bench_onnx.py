@@ -0,0 +1,56 @@
+import os,argparse,tempfile
+import torch
+
+from common import timeit,table,save_json,build,input_shape
+from onnx_export import export_onnx,ort_session,parity
+
+
+""" CPU inference latency of eager vs ONNX Runtime, with eager/ORT parity on a different batch size """
+
+def run(args,loss,backbone,tmp):
+    torch.manual_seed(0)
+    model=build(loss,backbone,C=args.C,D=args.D,dist=args.dist).eval()
+    outputs=('pred',) if loss=='vanilla' else ('pred','embedding')
+    if loss in ('PL','DCE'): outputs=('pred','distance','embedding')
+    x=torch.rand(args.batch_size,*input_shape(backbone))
+    path=os.path.join(tmp,'{}_{}.onnx'.format(backbone,loss))
+    wrapper=export_onnx(model,path,x,outputs,opset=args.opset)
+    session=ort_session(path,args.threads)
+    err=parity(wrapper,session,torch.rand(args.batch_size//2+1,*input_shape(backbone))) # dynamic batch
+    feed={'input':x.numpy()}
+    def eager():
+        with torch.no_grad(): return wrapper.reference(x)
+    rows=[]
+    for name,fn in [('eager',eager),('onnxruntime',lambda: session.run(None,feed))]:
+        t=timeit(fn,args.warmup,args.iters)
+        rows.append({'model':backbone,'loss':loss,'runtime':name,'ms':t['p50'],
+                     'img/s':args.batch_size/t['p50']*1e3,'error':max(err.values()) if name!='eager' else 0.0})
+    for r in rows: r['speedup']=rows[0]['ms']/r['ms']
+    rows[-1]['MB']=os.path.getsize(path)/2**20
+    rows[0]['MB']=rows[-1]['MB']
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='ONNX export benchmark (CPU)')
+    parser.add_argument('--models', nargs='+', default=['conv','resnet','vgg','mobilenet'])
+    parser.add_argument('--losses', nargs='+', default=['PL','DCE','TLA','vanilla'])
+    parser.add_argument('--dist', type=str, default='L2')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64)
+    parser.add_argument('--C', type=int, default=1)
+    parser.add_argument('--D', type=int, default=64)
+    parser.add_argument('--opset', type=int, default=17)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--iters', type=int, default=10)
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--out', type=str, default='', help='JSON results')
+    args = parser.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    rows=[]
+    with tempfile.TemporaryDirectory() as tmp:
+        for m in args.models:
+            for l in args.losses:
+                if l=='vanilla' and m=='conv': continue # ConvNet has no classifier
+                rows+=run(args,l,m,tmp)
+    print(table(['model','loss','runtime','ms','img/s','speedup','MB','error'],rows))
+    if args.out: save_json(args.out,rows,batch_size=args.batch_size,dist=args.dist)
@@ -0,0 +1,74 @@
+import argparse
+import torch
+import torchattacks
+
+from common import timeit,table,save_json,build,input_shape
+from trainer import loss_helper
+
+
+""" Training-step throughput of every loss x backbone on synthetic batches, with and without AT """
+
+def step(args,model,opt,x,y,attack=None):
+    """one trainer.train step (PL: separate adversarial norm term, others: half the batch adversarial)"""
+    adversarial_inputs=None
+    if attack:
+        bs=x.size(0)
+        model.eval()
+        if args.loss=='PL': adversarial_inputs=attack(x,y)
+        else: x=torch.cat((x[:bs//2],attack(x[bs//2:],y[bs//2:])),dim=0)
+        model.train()
+    output,loss,_=loss_helper(args,model,x,y,adversarial_inputs)
+    opt.zero_grad()
+    loss.backward()
+    opt.step()
+
+def attack_helper(name,model,eps):
+    if name=='fgsm': return torchattacks.FGSM(model,eps=eps)
+    return torchattacks.PGD(model,eps=eps,alpha=2/255,steps=7,random_start=True) # pgd7
+
+def run(args,loss,backbone):
+    torch.manual_seed(0)
+    step_args=argparse.Namespace(loss=loss,adv_norm=True,ploption=[0.1,0.2])
+    x=torch.rand(args.batch_size,*input_shape(backbone))
+    y=torch.randint(0,10,(args.batch_size,))
+    model=build(loss,backbone,C=args.C,D=args.D)
+    opt=torch.optim.SGD(model.parameters(),0.01,momentum=0.9)
+    eps=0.3 if backbone=='conv' else 8/255
+    rows=[]
+    for phase in args.phases:
+        if phase=='forward':
+            model.eval()
+            def fn():
+                with torch.no_grad(): model(x)
+        else:
+            model.train()
+            attack=None if phase=='train' else attack_helper(phase,model,eps)
+            fn=lambda: step(step_args,model,opt,x,y,attack)
+        t=timeit(fn,args.warmup,args.iters)
+        rows.append({'model':backbone,'loss':loss,'phase':phase,'ms':t['p50'],'p90':t['p90'],
+                     'img/s':args.batch_size/t['p50']*1e3})
+    return rows
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Training step throughput on synthetic data (CPU)')
+    parser.add_argument('--models', nargs='+', default=['conv','resnet','vgg','mobilenet'])
+    parser.add_argument('--losses', nargs='+', default=['vanilla','DCE','PL','TLA','NLA','PXA'])
+    parser.add_argument('--phases', nargs='+', default=['forward','train','fgsm','pgd7'],
+                        help='forward: no-grad eval, train: forward+backward+step, fgsm/pgd7: with AT')
+    parser.add_argument('--batch-size', dest='batch_size', type=int, default=64)
+    parser.add_argument('--C', type=int, default=1)
+    parser.add_argument('--D', type=int, default=64)
+    parser.add_argument('--warmup', type=int, default=2)
+    parser.add_argument('--iters', type=int, default=5)
+    parser.add_argument('--threads', type=int, default=0)
+    parser.add_argument('--out', type=str, default='', help='JSON results')
+    args = parser.parse_args()
+    if args.threads: torch.set_num_threads(args.threads)
+
+    rows=[]
+    for m in args.models:
+        for l in args.losses:
+            if l=='vanilla' and m=='conv': continue # ConvNet has no classifier
+            rows+=run(args,l,m)
+    print(table(['model','loss','phase','ms','p90','img/s'],rows))
+    if args.out: save_json(args.out,rows,batch_size=args.batch_size,C=args.C,D=args.D)
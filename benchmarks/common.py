@@ -0,0 +1,100 @@
+import os,sys,time,json
+import numpy as np
+import torch
+
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__)))) # repo root
+
+
+""" Shared timing helpers for the benchmark scripts """
+
+def sync(device):
+    if torch.device(device).type=='cuda': torch.cuda.synchronize()
+
+def timeit(fn,warmup=3,iters=10,device='cpu'):
+    """wall time of fn() after warm-up: {'mean','p50','p90','min'} in ms"""
+    for _ in range(warmup): fn()
+    sync(device)
+    times=[]
+    for _ in range(iters):
+        t=time.perf_counter()
+        fn()
+        sync(device)
+        times.append(1e3*(time.perf_counter()-t))
+    times=np.array(times)
+    return {'mean':float(times.mean()),'p50':float(np.percentile(times,50)),
+            'p90':float(np.percentile(times,90)),'min':float(times.min())}
+
+def peak_memory(fn,device='cpu'):
+    """peak MB of tensor memory allocated while running fn(), on top of what was live before"""
+    if torch.device(device).type=='cuda':
+        sync(device)
+        torch.cuda.reset_peak_memory_stats()
+        base=torch.cuda.memory_allocated()
+        fn()
+        sync(device)
+        return (torch.cuda.max_memory_allocated()-base)/2**20
+    with torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU],profile_memory=True) as p: fn()
+    cur=peak=0
+    for e in sorted(p.events(),key=lambda e: e.time_range.start): # allocations of ops, frees as [memory] events
+        cur+=e.cpu_memory_usage if e.name=='[memory]' else e.self_cpu_memory_usage
+        peak=max(peak,cur)
+    return peak/2**20
+
+def table(cols,rows):
+    """rows: list of dicts, cols: keys in print order"""
+    fmt=lambda v: '{:.3f}'.format(v) if isinstance(v,float) else str(v)
+    width=[max(len(c),*(len(fmt(r[c])) for r in rows))+2 for c in cols]
+    msg=''.join(c.rjust(w) for c,w in zip(cols,width))+'\n'
+    for r in rows: msg+=''.join(fmt(r[c]).rjust(w) for c,w in zip(cols,width))+'\n'
+    return msg
+
+def save_json(path,rows,**meta):
+    meta.update({'torch':torch.__version__,'threads':torch.get_num_threads()})
+    with open(path,'w') as f: json.dump({'meta':meta,'rows':rows},f,indent=1)
+
+def build(loss,backbone,C=1,D=64,dist='L2'):
+    """the trainer.model_helper models, left on the CPU"""
+    import vision_models as models
+    from ML.triplet_margin_loss import TripletMarginLoss as TML
+    from ML.n_pairs_loss import NPairsLoss as NPL
+    from ML.proxy_loss import ProxyLoss
+    if loss=='DCE': return models.DCEmodel(backbone,D)
+    elif loss=='PL': return models.PLmodel(backbone,C,D,dist,dist,dist)
+    elif loss=='TLA': return models.MLmodel(TML(),backbone,D)
+    elif loss=='NLA': return models.MLmodel(NPL(),backbone,D)
+    elif loss=='PXA': return models.MLmodel(ProxyLoss(10,D,C),backbone,D)
+    return models.Vanillamodel(backbone)
+
+def input_shape(backbone):
+    return (1,28,28) if backbone=='conv' else (3,32,32)
+
+def load_json(path):
+    with open(path) as f: return json.load(f)
+
+def regressions(rows,baseline,keys,metrics,threshold=0.2,floors={},drift=()):
+    """
+    messages for rows whose metrics exceed the matching baseline row (same values in keys)
+    by more than threshold (relative); rows missing from the baseline are skipped, and so are
+    metrics below floors[metric] in either run (timer noise dominates there). Metrics in
+    drift are compared after dividing by their median ratio over all rows, so a machine that
+    is uniformly slower than when the baseline was taken does not fail every row, but neither
+    does a real slowdown of half the rows or more, so it is opt-in for gates.
+    """
+    ref={tuple(r[k] for k in keys):r for r in baseline['rows']}
+    pairs=[(r,ref[tuple(r[k] for k in keys)]) for r in rows if tuple(r[k] for k in keys) in ref]
+    scale={}
+    for m in drift:
+        ratios=[r[m]/b[m] for r,b in pairs if m in b and b[m]>0 and min(r[m],b[m])>=floors.get(m,0)]
+        scale[m]=float(np.median(ratios)) if ratios else 1.
+        if ratios: print('Baseline: median {} ratio {:.3f} (machine drift, factored out)'.format(m,scale[m]))
+    msgs=[]
+    for r,b in pairs:
+        for m in metrics:
+            if m not in b: continue # baseline from an older version
+            if min(r[m],b[m])<floors.get(m,0): continue
+            ref_m=b[m]*scale.get(m,1.)
+            if ref_m>0 and r[m]>ref_m*(1+threshold):
+                msgs.append('{} {}: {:.3f} vs baseline {:.3f} (+{:.0%})'.format(
+                    ' '.join(str(r[k]) for k in keys),m,r[m],ref_m,r[m]/ref_m-1))
+    return msgs
+
@@ -0,0 +1,86 @@
+import os,threading,queue
+import torch
+
+
+""" Checkpoint writing: atomic on disk, serialized off the training thread """
+
+def snapshot(obj,half=False):
+    """Host copy of a (nested) state so training can keep mutating the originals"""
+    if torch.is_tensor(obj):
+        t=obj.detach().to('cpu',copy=True)
+        return t.half() if half and t.is_floating_point() else t
+    if isinstance(obj,dict): return type(obj)((k,snapshot(v,half)) for k,v in obj.items())
+    if isinstance(obj,(list,tuple)): return type(obj)(snapshot(v,half) for v in obj)
+    return obj
+
+def atomic_save(state,filename):
+    """temp file + fsync + rename: a crash leaves either the old or the new file, never a torn one"""
+    tmp=filename+'.tmp'
+    with open(tmp,'wb') as f:
+        torch.save(state,f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp,filename)
+    try:
+        fd=os.open(os.path.dirname(os.path.abspath(filename)),os.O_RDONLY)
+        try: os.fsync(fd)
+        finally: os.close(fd)
+    except OSError: pass # directories can't be fsynced on every platform
+
+def rotate_best(save_dir,savename,max_best=3):
+    """_best1 -> _best2 -> ... -> _best{max_best}, dropping the oldest"""
+    path=lambda i: os.path.join(save_dir, savename+'_best'+str(i)+'.th')
+    if os.path.exists(path(max_best)): os.remove(path(max_best))
+    for i in range(max_best-1,0,-1):
+        if os.path.exists(path(i)): os.replace(path(i),path(i+1))
+
+class CheckpointWriter:
+    """
+    Background writer: save() snapshots to host memory on the caller's thread and returns,
+    serialization and disk I/O run in a worker thread in submission order. A write error is
+    re-raised on the next call.
+    """
+    def __init__(self,max_pending=2):
+        self.queue=queue.Queue(max_pending)
+        self.error=None
+        self.thread=threading.Thread(target=self._worker,daemon=True)
+        self.thread.start()
+
+    def _worker(self):
+        while True:
+            task=self.queue.get()
+            if task is None: self.queue.task_done(); break
+            try: task()
+            except Exception as e: self.error=e
+            self.queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            e,self.error=self.error,None
+            raise e
+
+    def save(self,state,filename,half=False,done=None):
+        """done() is called from the writer thread once the file is on disk"""
+        self._check()
+        state=snapshot(state,half)
+        def task():
+            atomic_save(state,filename)
+            if done: done()
+        self.queue.put(task)
+
+    def save_best(self,state,save_dir,savename,max_best=3,half=False):
+        self._check()
+        state=snapshot(state,half)
+        def task():
+            rotate_best(save_dir,savename,max_best)
+            atomic_save(state,os.path.join(save_dir, savename+'_best1.th'))
+        self.queue.put(task)
+
+    def wait(self):
+        self.queue.join()
+        self._check()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self._check()
@@ -0,0 +1,72 @@
+import warnings
+import torch
+import torch.nn as nn
+
+
+""" Graph capture for the vision models: torch.compile for training, TorchScript traces for inference """
+
+def compile_model(model,mode='default',backend='inductor',dynamic=None,fallback=True):
+    """
+    Compile model.forward (backbone + EmbedLayer + head) in place, so state_dict keys, model.loss,
+    model.pl etc. are untouched and torchattacks/trainer keep calling the same object.
+    Python flags such as embed (and the backbone's pred) are guarded as constants by dynamo,
+    i.e. one graph per flag value rather than a recompile per call; batch size changes
+    (last batch, half-adversarial batches) are handled by dynamic shapes after the first
+    recompile. With fallback, an error while compiling or running the graph switches the
+    model back to eager with a warning instead of killing the run.
+    """
+    if getattr(model,'_eager_forward',None) is not None: return model # already compiled
+    eager=model.forward
+    try: compiled=torch.compile(eager,mode=mode,backend=backend,dynamic=dynamic)
+    except Exception as e:
+        if not fallback: raise
+        warnings.warn('torch.compile unavailable, running eager: '+repr(e))
+        return model
+    def forward(*args,**kwargs):
+        try: return compiled(*args,**kwargs)
+        except Exception as e:
+            if not fallback: raise
+            warnings.warn('torch.compile failed, falling back to eager: '+repr(e))
+            uncompile(model)
+            return eager(*args,**kwargs)
+    model._eager_forward=eager
+    model.forward=forward
+    return model
+
+def uncompile(model):
+    """restore the eager forward, e.g. before pickling the model"""
+    eager=getattr(model,'_eager_forward',None)
+    if eager is not None:
+        del model.forward
+        model._eager_forward=None
+    return model
+
+class _Fixed(nn.Module):
+    """model(x, embed) with the flag bound, traced as x -> output(s)"""
+    def __init__(self,model,embed):
+        super(_Fixed, self).__init__()
+        self.model,self.embed=model,embed
+    def forward(self,x): return self.model(x,True) if self.embed else self.model(x)
+
+class TracedModel(nn.Module):
+    """
+    Inference-only TorchScript version of a trained model with the forward(x, embed=False)
+    signature: one frozen trace per embed value, created on first use from that input.
+    Dropout/BatchNorm are traced in eval mode, so this is for evaluation, not training.
+    """
+    def __init__(self,model,freeze=True):
+        super(TracedModel, self).__init__()
+        self.model=model.eval()
+        self.freeze=freeze
+        self.traced={}
+
+    def trace(self,x,embed=False):
+        with torch.no_grad(): traced=torch.jit.trace(_Fixed(self.model,embed).eval(),x)
+        if self.freeze: traced=torch.jit.freeze(traced)
+        self.traced[embed]=traced
+        return traced
+
+    def forward(self,x,embed=False):
+        traced=self.traced.get(embed)
+        if traced is None: traced=self.trace(x,embed)
+        return traced(x)
@@ -0,0 +1,161 @@
+import threading,queue
+import numpy as np
+import torch
+
+
+class IndexedDataset(torch.utils.data.Dataset):
+    """Yields (index, img, target) like IL.data_loader.iCIFAR10, for per-sample state"""
+    def __init__(self,dataset): self.dataset=dataset
+    def __getitem__(self,index): return (index,)+tuple(self.dataset[index])
+    def __len__(self): return len(self.dataset)
+
+
+class PKBatchSampler(torch.utils.data.Sampler):
+    """
+    Batches of P classes x K samples each, so every sample has positives (and negatives) in its
+    batch for the triplet / N-pair losses. Classes are drawn uniformly; each class walks through
+    its own shuffled index array (precomputed from labels once) and reshuffles when it runs out,
+    classes with fewer than K samples are drawn with replacement. An epoch has
+    len(labels) // (P*K) batches in total, split between num_replicas (rank takes every
+    num_replicas-th batch) from the same seed; call set_epoch like DistributedSampler.
+    P is capped at the number of classes present (e.g. the first class increment in IL).
+    """
+    def __init__(self,labels,P,K,num_replicas=1,rank=0,seed=0):
+        labels=np.asarray(labels)
+        self.classes=np.unique(labels)
+        self.index=[np.flatnonzero(labels==c) for c in self.classes]
+        self.P,self.K=min(P,len(self.classes)),K
+        self.num_replicas,self.rank,self.seed=num_replicas,rank,seed
+        self.num_batches=max(1,len(labels)//(self.P*K))//num_replicas
+        self.epoch=0
+
+    def set_epoch(self,epoch): self.epoch=epoch
+
+    def __len__(self): return self.num_batches
+
+    def __iter__(self):
+        rng=np.random.RandomState(self.seed+self.epoch) # same batches on every replica
+        order=[rng.permutation(idx) for idx in self.index]
+        pos=[0]*len(order)
+        for b in range(self.num_batches*self.num_replicas):
+            classes=rng.choice(len(order),self.P,replace=False)
+            batch=[] # built on every replica to keep the shared rng and positions in step
+            for c in classes:
+                idx=order[c]
+                if len(idx)<self.K: batch.append(rng.choice(idx,self.K)); continue
+                if pos[c]+self.K>len(idx): order[c],pos[c]=rng.permutation(idx),0
+                batch.append(order[c][pos[c]:pos[c]+self.K])
+                pos[c]+=self.K
+            if b%self.num_replicas==self.rank: yield np.concatenate(batch).tolist()
+
+
+""" Tensor-native loading """
+
+def to_uint8_tensor(data):
+    """Stack a torchvision dataset's raw storage into a contiguous NCHW uint8 tensor"""
+    data=torch.as_tensor(np.asarray(data),dtype=torch.uint8)
+    if data.dim()==3: data=data.unsqueeze(1) # MNIST: NHW
+    elif data.shape[-1] in [1,3]: data=data.permute(0,3,1,2) # CIFAR: NHWC, SVHN is already NCHW
+    return data.contiguous()
+
+def batch_augment(x,crop=4,flip=True):
+    """
+    Same distribution as RandomHorizontalFlip()+RandomCrop(H,crop) applied per sample,
+    done for the whole uint8 batch with one gather. Flipping before a uniform crop
+    offset equals flipping the crop window, so both are folded into the index grid.
+    """
+    B,C,H,W=x.shape
+    return gather_grid(x,augment_grid(B,H,W,crop,flip,x.device),crop)
+
+def augment_grid(B,H,W,crop=4,flip=True,device='cpu'):
+    """random crop/flip windows of B images as (rows, cols) indices into the crop-padded images"""
+    oy=torch.randint(0,2*crop+1,(B,1),device=device)
+    ox=torch.randint(0,2*crop+1,(B,1),device=device)
+    rows=oy+torch.arange(H,device=device)
+    cols=torch.arange(W,device=device).expand(B,W)
+    if flip: cols=torch.where(torch.rand(B,1,device=device)<0.5,W-1-cols,cols)
+    return rows,ox+cols
+
+def _grid_index(x,grid):
+    rows,cols=grid
+    b=torch.arange(x.shape[0],device=x.device)[:,None,None,None]
+    c=torch.arange(x.shape[1],device=x.device)[None,:,None,None]
+    return b,c,rows[:,None,:,None],cols[:,None,None,:]
+
+def gather_grid(x,grid,crop=4):
+    """x cropped/flipped by an augment_grid"""
+    if crop: x=torch.nn.functional.pad(x,(crop,crop,crop,crop))
+    return x[_grid_index(x,grid)]
+
+def scatter_grid(base,x,grid,crop=4):
+    """inverse of gather_grid: base with the pixels x was gathered from replaced by x"""
+    H,W=base.shape[2:]
+    out=torch.nn.functional.pad(base,(crop,crop,crop,crop)) if crop else base.clone()
+    out[_grid_index(out,grid)]=x.to(out.dtype)
+    return out[:,:,crop:crop+H,crop:crop+W] if crop else out
+
+class TensorLoader:
+    """
+    Drop-in replacement of DataLoader for datasets that fit in memory: the whole dataset is
+    kept as one uint8 tensor (optionally on the training device) and batches are augmented
+    and converted to float with vectorized ops instead of per-sample PIL transforms.
+    background=True prepares the next batches in a thread while the current one trains.
+    """
+    def __init__(self,data,targets,batch_size=256,shuffle=False,augment=False,crop=4,flip=True,
+                 device='cpu',background=False,prefetch=2,indices=False,batch_sampler=None):
+        self.data=to_uint8_tensor(data).to(device)
+        self.targets=torch.as_tensor(np.asarray(targets)).long().to(device)
+        self.batch_size,self.shuffle=batch_size,shuffle
+        self.augment,self.crop,self.flip=augment,crop,flip
+        self.device=device
+        self.background,self.prefetch=background,prefetch
+        self.indices=indices # also yield sample indices, like iCIFAR10
+        self.batch_sampler=batch_sampler
+
+    def __len__(self):
+        if self.batch_sampler is not None: return len(self.batch_sampler)
+        return (len(self.data)+self.batch_size-1)//self.batch_size
+
+    def _order(self):
+        if self.batch_sampler is not None:
+            for batch in self.batch_sampler: yield torch.as_tensor(batch,device=self.device)
+            return
+        n=len(self.data)
+        order=torch.randperm(n,device=self.device) if self.shuffle else torch.arange(n,device=self.device)
+        for i in range(0,n,self.batch_size): yield order[i:i+self.batch_size]
+
+    def _batch(self,idx):
+        x=self.data[idx]
+        if self.augment: x=batch_augment(x,self.crop,self.flip)
+        x=x.float().div_(255) # ToTensor
+        if self.indices: return idx,x,self.targets[idx]
+        return x,self.targets[idx]
+
+    def __iter__(self):
+        if not self.background:
+            for idx in self._order(): yield self._batch(idx)
+            return
+        q=queue.Queue(self.prefetch)
+        stop=threading.Event()
+        def worker():
+            try:
+                for idx in self._order():
+                    if stop.is_set(): return
+                    q.put(self._batch(idx))
+            except BaseException as e: # handed to the consumer, which would otherwise wait forever
+                q.put(e)
+                return
+            q.put(None)
+        t=threading.Thread(target=worker,daemon=True)
+        t.start()
+        try:
+            while True:
+                batch=q.get()
+                if batch is None: break
+                if isinstance(batch,BaseException): raise batch
+                yield batch
+        finally: # consumer stopped early, unblock the worker
+            stop.set()
+            while t.is_alive():
+                try: q.get_nowait()
+                except queue.Empty: t.join(0.01)
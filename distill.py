@@ -0,0 +1,129 @@
+import os,copy,json
+import numpy as np
+import torch
+import torch.nn.functional as F
+import torchvision.transforms as transforms
+
+from data_utils import TensorLoader,IndexedDataset
+
+
+""" Distillation of a trained PLmodel into a smaller backbone from cached teacher outputs """
+
+def plain_loader(loader):
+    """the training set of loader in order, without augmentation, yielding (index, img, target)"""
+    if isinstance(loader,TensorLoader):
+        plain=copy.copy(loader)
+        plain.shuffle,plain.augment,plain.background,plain.indices,plain.batch_sampler=False,False,False,True,None
+        return plain
+    d=loader.dataset
+    d=copy.copy(d.dataset if isinstance(d,IndexedDataset) else d)
+    d.transform=transforms.ToTensor() # the train transforms only add flip/crop
+    return torch.utils.data.DataLoader(IndexedDataset(d),batch_size=loader.batch_size,shuffle=False,
+        num_workers=loader.num_workers,pin_memory=loader.pin_memory)
+
+def source_key(path):
+    """identity of the checkpoint a cache is computed from (path, size, mtime), None without one"""
+    if path is None or not os.path.isfile(path): return None
+    st=os.stat(path)
+    return {'path':os.path.abspath(path),'size':st.st_size,'mtime_ns':st.st_mtime_ns}
+
+def _source_path(path): return os.path.splitext(path)[0]+'_source.json'
+
+def source_matches(path,key):
+    """the cache at path was built from the checkpoint with this source_key"""
+    try:
+        with open(_source_path(path)) as f: return json.load(f)==key
+    except (OSError,ValueError): return False
+
+def save_source(path,key):
+    with open(_source_path(path),'w') as f: json.dump(key,f)
+
+def build_memmap(path,shape,fill,source=None):
+    """
+    fp16 .npy at path written by fill(store) into a memory-mapped temporary file that replaces
+    path only once complete (a half-written cache is never picked up), with its source_key;
+    returns the finished file memory-mapped read-only
+    """
+    tmp=path+'.tmp.npy'
+    store=np.lib.format.open_memmap(tmp,mode='w+',dtype=np.float16,shape=shape)
+    fill(store)
+    store.flush()
+    del store
+    os.replace(tmp,path)
+    save_source(path,source)
+    return np.load(path,mmap_mode='r')
+
+def share_prototypes(student,teacher):
+    """the student classifies with the teacher's (fixed) prototypes, so cached distances stay valid targets"""
+    student.pl.embeds.data.copy_(teacher.pl.embeds.data)
+    student.pl.embeds.requires_grad_(False)
+    return student
+
+class TeacherCache:
+    """
+    Teacher embedding (D) and loss distance (K) of every training sample, indexed by
+    dataset index, in one fp16 memory-mapped .npy of shape (n, D+K). Computed once from the
+    unaugmented images; a file of the right shape is reused by later runs (reuse=False,
+    e.g. for a random ratio<1 subset, recomputes it) as long as it was built from the same
+    teacher checkpoint (source: its source_key, kept in <path>_source.json).
+    """
+    def __init__(self,path,n,D,K,reuse=True,source=None):
+        self.path,self.D,self.source=path,D,source
+        shape=(n,D+K)
+        if reuse and os.path.isfile(path) and source_matches(path,source):
+            store=np.load(path,mmap_mode='r')
+            if store.shape==shape and store.dtype==np.float16:
+                self.store=store
+                return
+        self.store=None
+        self.shape=shape
+
+    @property
+    def ready(self): return self.store is not None
+
+    def build(self,teacher,loader):
+        def fill(store):
+            training=teacher.training
+            teacher.eval()
+            with torch.no_grad():
+                for index,input,_ in loader:
+                    _,distance,x=teacher(input.cuda(),True)
+                    store[index.cpu().numpy()]=torch.cat((x,distance),1).cpu().numpy().astype(np.float16)
+            teacher.train(training)
+        self.store=build_memmap(self.path,self.shape,fill,self.source)
+
+    def get(self,index,device):
+        out=torch.from_numpy(self.store[index.cpu().numpy()].astype(np.float32)).to(device)
+        return out[:,:self.D],out[:,self.D:]
+
+class Distiller:
+    """
+    Loss of a PL student against the cached outputs of a trained PL teacher:
+        alpha * MSE(student embedding, teacher embedding)
+        + beta * T^2 * KL(softmax(-d_teacher/T) || softmax(-d_student/T))
+        + the student's own PL loss
+    The distances are the teacher's prototypes' loss distances (see share_prototypes).
+    checkpoint: the teacher's checkpoint file, a retrained teacher invalidates the cache.
+    """
+    def __init__(self,teacher,path,T=4,alpha=1,beta=1,checkpoint=None):
+        self.teacher,self.path,self.checkpoint=teacher,path,checkpoint
+        self.T,self.alpha,self.beta=T,alpha,beta
+        self.cache=None
+
+    def prepare(self,train_loader,reuse=True):
+        """load or compute the teacher cache for train_loader's samples; the teacher is not needed afterwards"""
+        n=len(train_loader.data) if isinstance(train_loader,TensorLoader) else len(train_loader.dataset)
+        pl=self.teacher.pl
+        self.cache=TeacherCache(self.path,n,pl.embeds.shape[1],pl.K,reuse,source_key(self.checkpoint))
+        if self.cache.ready: print('=> teacher outputs from',self.path)
+        else:
+            print('=> caching teacher outputs to',self.path)
+            self.cache.build(self.teacher,plain_loader(train_loader))
+        self.teacher=None
+        return self
+
+    def loss(self,model,x,distance,y,index,option=[0.1,0.2]):
+        t_emb,t_dist=self.cache.get(index,x.device)
+        T=self.T
+        kl=F.kl_div(F.log_softmax(-distance/T,1),F.softmax(-t_dist/T,1),reduction='batchmean')*T*T
+        return model.loss(None,x,distance,y,option=option)+self.alpha*F.mse_loss(x,t_emb)+self.beta*kl
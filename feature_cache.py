@@ -0,0 +1,96 @@
+import os,copy
+import numpy as np
+import torch
+import torch.nn as nn
+
+from data_utils import TensorLoader,IndexedDataset
+from distill import plain_loader,source_matches,build_memmap
+
+
+""" Frozen-backbone feature cache: backbone features once, EmbedLayer + head trained on them """
+
+def indexed_loader(loader):
+    """the training set of loader in order, with its augmentation, yielding (index, img, target)"""
+    if isinstance(loader,TensorLoader):
+        indexed=copy.copy(loader)
+        indexed.shuffle,indexed.indices,indexed.batch_sampler=False,True,None
+        return indexed
+    d=loader.dataset
+    if not isinstance(d,IndexedDataset): d=IndexedDataset(d)
+    return torch.utils.data.DataLoader(d,batch_size=loader.batch_size,shuffle=False,
+        num_workers=loader.num_workers,pin_memory=loader.pin_memory)
+
+class FeatureCache:
+    """
+    Backbone output (the vector EmbedLayer reads) of every sample in `views` passes over a
+    dataset, as one fp16 memory-mapped .npy of shape (views, n, d_f); view 0 is unaugmented,
+    the others are augmented passes. Targets are kept next to it in <path>_targets.npy.
+    A cache of the right shape built from the same backbone checkpoint (source: its
+    distill.source_key, kept in <path>_source.json) is reused (reuse=False recomputes it).
+    """
+    def __init__(self,path,n,d_f,views=1,reuse=True,source=None):
+        self.path,self.shape,self.source=path,(views,n,d_f),source
+        self.tpath=os.path.splitext(path)[0]+'_targets.npy'
+        self.store=self.targets=None
+        if reuse and os.path.isfile(path) and os.path.isfile(self.tpath) and source_matches(path,source):
+            store=np.load(path,mmap_mode='r')
+            if store.shape==self.shape and store.dtype==np.float16:
+                self.store,self.targets=store,np.load(self.tpath)
+
+    @property
+    def ready(self): return self.store is not None
+
+    def build(self,net,loader):
+        """net: backbone, loader: indexed training (or validation) loader"""
+        targets=np.zeros(self.shape[1],dtype=np.int64)
+        def fill(store):
+            training=net.training
+            net.eval()
+            with torch.no_grad():
+                for v in range(self.shape[0]):
+                    for index,input,target in plain_loader(loader) if v==0 else indexed_loader(loader):
+                        index=index.cpu().numpy()
+                        store[v,index]=net(input.cuda()).cpu().numpy().astype(np.float16)
+                        targets[index]=target.cpu().numpy()
+            net.train(training)
+            np.save(self.tpath,targets)
+        self.store,self.targets=build_memmap(self.path,self.shape,fill,self.source),targets
+
+class FeatureLoader:
+    """
+    (features, target) batches from a FeatureCache, held on `device` as one fp16 tensor;
+    with shuffle every sample is drawn from a random view each epoch
+    """
+    def __init__(self,cache,batch_size=256,shuffle=False,device='cpu'):
+        self.data=torch.from_numpy(np.array(cache.store)).to(device) # one read of the memmap
+        self.targets=torch.from_numpy(cache.targets).to(device)
+        self.batch_size,self.shuffle,self.device=batch_size,shuffle,device
+
+    def __len__(self): return (self.data.shape[1]+self.batch_size-1)//self.batch_size
+
+    def __iter__(self):
+        views,n=self.data.shape[:2]
+        order=torch.randperm(n,device=self.device) if self.shuffle else torch.arange(n,device=self.device)
+        view=torch.randint(0,views,(n,),device=self.device) if self.shuffle else torch.zeros(n,dtype=torch.long,device=self.device)
+        for i in range(0,n,self.batch_size):
+            idx=order[i:i+self.batch_size]
+            yield self.data[view[idx],idx].float(),self.targets[idx]
+
+class FeatureNet(nn.Module):
+    """
+    Stands in for the backbone of a model trained on cached features: forward(x, pred=False)
+    passes the features through, pred applies the backbone's own classifier (Vanillamodel)
+    """
+    def __init__(self,classifier=None):
+        super(FeatureNet, self).__init__()
+        self.classifier=classifier
+    def forward(self,x,pred=False): return self.classifier(x) if pred else x
+
+def head_model(model):
+    """model (built by trainer.model_helper) with its backbone replaced by a FeatureNet"""
+    net,classifier=model.net,None
+    if not hasattr(model,'emb'): classifier=net.fc if hasattr(net,'fc') else net.classifier # resnet / vgg, mobilenet
+    if isinstance(classifier,nn.Sequential) and isinstance(classifier[0],nn.ReLU):
+        classifier[0].inplace=False # the feature batch is shared by every head (vgg)
+    model.net=FeatureNet(classifier)
+    return model
@@ -0,0 +1,102 @@
+import copy
+import torch
+import torch.nn as nn
+from compiled import _Fixed
+
+
+""" Freeze for inference: BatchNorm folding, Dropout removal, channels_last and TorchScript """
+
+def fold_conv_bn(conv,bn):
+    """conv followed by eval-mode bn as one conv: w*g/s, (b-mean)*g/s+beta with s=sqrt(var+eps)"""
+    scale=bn.weight/torch.sqrt(bn.running_var+bn.eps)
+    fused=copy.deepcopy(conv)
+    fused.weight=nn.Parameter((conv.weight*scale.view(-1,1,1,1)).detach())
+    bias=conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    fused.bias=nn.Parameter(((bias-bn.running_mean)*scale+bn.bias).detach())
+    return fused
+
+def fold_bn(module):
+    """
+    Fold every BatchNorm2d into the Conv2d registered right before it in the same parent and
+    replace the BN by Identity. Registration order matches the call order in all backbones
+    here (resnet BasicBlock conv1/bn1, downsample and ConvBNActivation Sequentials, VGG
+    make_layers, ConvNet convX_Y/bnX_Y); freeze_model verifies the result numerically.
+    """
+    prev=None
+    for name,child in module.named_children():
+        if isinstance(child,nn.BatchNorm2d) and isinstance(prev,tuple) and prev[1].out_channels==child.num_features:
+            setattr(module,prev[0],fold_conv_bn(prev[1],child))
+            setattr(module,name,nn.Identity())
+            prev=None
+            continue
+        if isinstance(child,nn.Conv2d): prev=(name,child)
+        else:
+            fold_bn(child)
+            prev=None
+    return module
+
+def drop_dropout(module):
+    for name,child in module.named_children():
+        if isinstance(child,nn.Dropout): setattr(module,name,nn.Identity())
+        else: drop_dropout(child)
+    return module
+
+class FrozenBackbone(nn.Module):
+    """
+    Inference backbone with the vision backbones' forward(x, pred=False) signature: BN folded,
+    no Dropout, channels_last weights and inputs. With jit, one frozen TorchScript trace per
+    pred value passed through torch.jit.optimize_for_inference, which fuses conv+ReLU (and
+    conv+add) where the CPU backend supports it.
+    """
+    def __init__(self,net,jit=False,channels_last=True):
+        super(FrozenBackbone, self).__init__()
+        self.net=drop_dropout(fold_bn(copy.deepcopy(net).eval()))
+        self.channels_last=channels_last
+        if channels_last: self.net=self.net.to(memory_format=torch.channels_last)
+        self.jit=jit
+        self.traced={}
+
+    def trace(self,x,pred=False):
+        with torch.no_grad(): 
+            traced=torch.jit.trace(_Fixed(self.net,pred).eval(),x)
+            try: 
+                optimized=torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+                optimized(x)
+            except RuntimeError: # e.g. mkldnn has no adaptive pooling 1x1 -> 7x7 (VGG on 32x32 inputs)
+                optimized=torch.jit.freeze(traced)
+        self.traced[pred]=optimized
+        return optimized
+
+    def forward(self,x,pred=False):
+        if self.channels_last and x.dim()==4: x=x.contiguous(memory_format=torch.channels_last)
+        if not self.jit: return self.net(x,True) if pred else self.net(x)
+        traced=self.traced.get(pred)
+        if traced is None: traced=self.trace(x,pred)
+        return traced(x)
+
+def max_error(ref,out):
+    """max abs difference, relative to the output scale when that is above 1"""
+    if torch.is_tensor(ref): return ((ref.float()-out.float()).abs().max()/ref.float().abs().max().clamp_min(1)).item()
+    return max(max_error(r,o) for r,o in zip(ref,out))
+
+def freeze_model(model,example,jit=False,channels_last=True,tol=1e-4):
+    """
+    Inference copy of a vision_models model (Vanilla/DCE/ML/PL) whose backbone is a
+    FrozenBackbone and whose EmbedLayer has no Dropout; forward(x) and forward(x, True) keep
+    their outputs. Both are checked against the original on `example` (max_error <= tol,
+    RuntimeError otherwise). The original model is left as it was. Which of jit and
+    channels_last pays off depends on the backbone, see benchmarks/bench_freeze.py.
+    """
+    training=model.training
+    model.eval()
+    frozen=drop_dropout(copy.deepcopy(model))
+    frozen.net=FrozenBackbone(model.net,jit,channels_last)
+    frozen.eval()
+    with torch.no_grad():
+        checks=[(model(example),frozen(example))]
+        if hasattr(model,'emb'): # all but Vanillamodel have the embed outputs
+            checks.append((model(example,True),frozen(example,True)))
+    model.train(training)
+    err=max(max_error(r,o) for r,o in checks)
+    if err>tol: raise RuntimeError('frozen model differs from the original: max error {:.2e}'.format(err))
+    return frozen
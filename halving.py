@@ -0,0 +1,67 @@
+import os,json,math
+
+from scheduler import Job,Scheduler
+
+
+""" Successive halving over sweep configurations """
+
+def rung_budgets(min_budget,max_budget,eta=3):
+    """geometric budgets max_budget*eta^-k, k=K..0, with the smallest >= min_budget"""
+    K=int(math.floor(math.log(max_budget/min_budget,eta)+1e-9))
+    return [max(1,int(round(max_budget/eta**k))) for k in range(K,-1,-1)]
+
+class SuccessiveHalving:
+    """
+    Successive halving (Jamieson & Talwalkar, 2016): every config is trained to the first
+    budget, the top 1/eta by score are promoted to the next budget, and so on up to
+    max_budget. run(name,cfg,budget) has to continue from the config's checkpoint, so a
+    promotion only pays for the extra epochs; score(name,cfg) returns the selection
+    quantity (higher is better). Rung results are kept in the JSON state file and a
+    restarted search picks up where it stopped. workers>0 runs each rung on a Scheduler.
+    """
+    def __init__(self,configs,run,score,min_budget,max_budget,eta=3,state='halving_state.json'):
+        self.configs=configs # {name: cfg}
+        self.run_fn,self.score_fn=run,score
+        self.budgets=rung_budgets(min_budget,max_budget,eta)
+        self.eta=eta
+        self.state_path=state
+        self.state={'rungs':[]} # [{'budget': b, 'scores': {name: score}}]
+        if os.path.isfile(state):
+            with open(state) as f: self.state=json.load(f)
+
+    def _save(self):
+        tmp=self.state_path+'.tmp'
+        with open(tmp,'w') as f: json.dump(self.state,f,indent=1)
+        os.replace(tmp,self.state_path)
+
+    def _rung(self,names,budget,workers,threads):
+        if workers:
+            jobs=[Job('b'+str(budget)+':'+n,self.run_fn,(n,self.configs[n],budget),threads=threads) for n in names]
+            Scheduler(jobs,workers,state=os.path.splitext(self.state_path)[0]+'_b'+str(budget)+'.json').run()
+        else:
+            for n in names: self.run_fn(n,self.configs[n],budget)
+        scores={}
+        for n in names:
+            try: scores[n]=float(self.score_fn(n,self.configs[n]))
+            except Exception as e: print('Halving: no score for',n,repr(e)) # failed run, dropped
+        return scores
+
+    def run(self,workers=0,threads=1):
+        names=list(self.configs)
+        epochs_used=0
+        for r,budget in enumerate(self.budgets):
+            if r<len(self.state['rungs']): scores=self.state['rungs'][r]['scores'] # finished before
+            else:
+                print('Halving: rung {} budget {} with {} configs'.format(r,budget,len(names)))
+                scores=self._rung(names,budget,workers,threads)
+                self.state['rungs'].append({'budget':budget,'scores':scores})
+                self._save()
+            epochs_used+=(budget-(self.budgets[r-1] if r else 0))*len(names)
+            ranked=sorted(scores,key=lambda n:-scores[n])
+            for n in ranked: print('  {:<40}{:>10.3f}'.format(n,scores[n]))
+            if r<len(self.budgets)-1: names=ranked[:max(1,len(ranked)//self.eta)]
+            else: names=ranked
+        full=len(self.configs)*self.budgets[-1]
+        print('Halving finished: best {}, {} epochs ({:.1f}% of a full sweep)'.format(
+            names[0] if names else None,epochs_used,100*epochs_used/max(full,1)))
+        return self.state
@@ -171,7 +171,7 @@ class ConvNet(nn.Module):
         x = self.prelu3_1(self.bn3_1(self.conv3_1(x)))
         x = self.prelu3_2(self.bn3_2(self.conv3_2(x)))
         x = F.max_pool2d(x, 2)
-        x= x.view(-1, 128 * 3 * 3)
+        x= x.reshape(-1, 128 * 3 * 3)
         if emb: x=self.emb(self.prelu(self.lin(x)))
         return x
 
@@ -0,0 +1,107 @@
+import copy
+import numpy as np
+import torch
+import torch.nn as nn
+
+import vision_models as models
+from vision_models import plain_distance
+from vision.vgg import VGG
+
+
+""" ONNX export of the vision models with the prototype heads as plain tensor ops """
+
+class ExportModel(nn.Module):
+    """
+    x -> selected outputs of a Vanilla/DCE/ML/PL model:
+        pred: the model's forward(x)
+        distance: PL loss distance (reshaped and averaged over the C prototypes per class),
+            DCE squared distance to the centers
+        embedding: the vector the head works on (PL/ML EmbedLayer output, DCE features)
+    The distances are computed with plain_distance, so the graph has matmul/reduce nodes
+    only. Dropout/BatchNorm are exported in eval mode.
+    """
+    def __init__(self,model,outputs=('pred',)):
+        super(ExportModel, self).__init__()
+        self.model=model
+        have={'pred'}
+        if isinstance(model,(models.PLmodel,models.DCEmodel)): have|={'distance','embedding'}
+        elif isinstance(model,models.MLmodel): have|={'embedding'}
+        missing=set(outputs)-have
+        if missing: raise ValueError('{} has no output {}'.format(type(model).__name__,sorted(missing)))
+        self.outputs=tuple(outputs)
+        self.eval()
+
+    def forward(self,x):
+        m=self.model
+        if isinstance(m,models.Vanillamodel): return m(x)
+        emb=m.emb(m.net(x))
+        if isinstance(m,models.PLmodel):
+            pl=m.pl
+            distance=plain_distance(pl.loss_dist,emb,pl.embeds).reshape(-1,pl.C,pl.K).mean(1)
+            pred=-plain_distance(pl.pred_dist,emb,pl.embeds).reshape(-1,pl.C,pl.K).mean(1)
+        elif isinstance(m,models.DCEmodel):
+            emb=m.preluip1(m.ip1(emb))
+            _,pred=m.dce(emb)
+            distance=-pred
+        else: pred,distance=m.linear(emb),None
+        res={'pred':pred,'distance':distance,'embedding':emb}
+        out=tuple(res[o] for o in self.outputs)
+        return out[0] if len(out)==1 else out
+
+    def reference(self,x):
+        """the same outputs from the model's own (eager, pytorch_metric_learning) forward"""
+        m=self.model
+        with torch.no_grad():
+            if isinstance(m,models.Vanillamodel): res={'pred':m(x)}
+            elif isinstance(m,models.PLmodel):
+                pred,distance,emb=m(x,True)
+                res={'pred':pred,'distance':distance,'embedding':emb}
+            elif isinstance(m,models.DCEmodel):
+                features,_,pred=m(x,True)
+                res={'pred':pred,'distance':-pred,'embedding':features}
+            else:
+                pred,emb=m(x,True)
+                res={'pred':pred,'embedding':emb}
+        return tuple(res[o] for o in self.outputs)
+
+def fold_vgg(model,example):
+    """
+    a copy of model whose VGG backbone, when example gives it 1x1 feature maps, runs the pool
+    fold (see VGG._folded_weight) as a plain Linear(512, 4096) with the folded weight, so the
+    export carries that instead of the 25088-wide lin[0] summed in every inference;
+    other models are returned as they are
+    """
+    net=getattr(model,'net',None)
+    if not isinstance(net,VGG) or not net.fold_pool: return model
+    model=copy.deepcopy(model).eval()
+    net=model.net
+    with torch.no_grad():
+        if net.features(example[:1]).shape[-2:]!=(1,1): return model
+        lin=net.lin[0]
+        folded=nn.Linear(lin.in_features//49,lin.out_features)
+        folded.weight.copy_(net._folded_weight())
+        folded.bias.copy_(lin.bias)
+    net.avgpool,net.lin[0],net.fold_pool=nn.Identity(),folded,False
+    net._fold_key,net._fold_cache=None,None
+    return model
+
+def export_onnx(model,path,example,outputs=('pred',),opset=17,dynamic_batch=True):
+    """write model (see ExportModel for outputs) to an ONNX file, batch axis dynamic"""
+    wrapper=ExportModel(fold_vgg(model,example),outputs)
+    axes={n:{0:'batch'} for n in ('input',)+tuple(outputs)} if dynamic_batch else None
+    with torch.no_grad():
+        torch.onnx.export(wrapper,(example,),path,input_names=['input'],output_names=list(outputs),
+                          dynamic_axes=axes,opset_version=opset,dynamo=False)
+    return wrapper
+
+def ort_session(path,threads=0):
+    import onnxruntime as ort # optional dependency, only for running exported graphs
+    opts=ort.SessionOptions()
+    if threads: opts.intra_op_num_threads=threads
+    return ort.InferenceSession(path,opts,providers=['CPUExecutionProvider'])
+
+def parity(wrapper,session,x):
+    """{output: max abs error} between onnxruntime and the eager model"""
+    got=session.run(None,{'input':x.cpu().numpy()})
+    ref=wrapper.reference(x)
+    return {n:float(np.abs(g-r.cpu().numpy()).max()) for n,g,r in zip(wrapper.outputs,got,ref)}
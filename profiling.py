@@ -0,0 +1,97 @@
+import time,json,threading
+import torch
+
+
+""" Phase-level profiling with Chrome trace / Perfetto export """
+
+class _NullPhase:
+    def __enter__(self): return self
+    def __exit__(self,*exc): return False
+
+_NULL=_NullPhase()
+
+class _Phase:
+    __slots__=['prof','name','t0']
+    def __init__(self,prof,name): self.prof,self.name=prof,name
+    def __enter__(self):
+        if self.prof.sync: torch.cuda.synchronize()
+        self.t0=time.perf_counter_ns()
+        return self
+    def __exit__(self,*exc):
+        if self.prof.sync: torch.cuda.synchronize()
+        self.prof.record(self.name,self.t0,time.perf_counter_ns())
+        return False
+
+class PhaseProfiler:
+    """
+    Named phase timers: `with prof.phase('backward'): ...`. Disabled (the default) a phase is
+    one attribute check returning a shared no-op context manager. sync=True synchronizes CUDA
+    at phase boundaries so asynchronous kernels are charged to the phase that launched them.
+    Phase totals are aggregated per epoch; the individual intervals for the trace are kept up
+    to trace_limit, later ones are only counted.
+    """
+    def __init__(self,enabled=False,sync=False,trace_limit=200000):
+        self.enabled=enabled
+        self.sync=sync and torch.cuda.is_available()
+        self.trace_limit=trace_limit
+        self.reset()
+
+    def reset(self):
+        self.events=[] # (name, start_ns, end_ns, thread, epoch), the first trace_limit
+        self.dropped=0
+        self.stats={} # epoch -> {name: [calls, total_ns]}
+        self.epochs={} # epoch -> [start_ns, end_ns]
+        self.current=0
+
+    def enable(self,sync=False):
+        self.enabled=True
+        self.sync=sync and torch.cuda.is_available()
+
+    def phase(self,name):
+        if not self.enabled: return _NULL
+        return _Phase(self,name)
+
+    def record(self,name,t0,t1):
+        """add an interval measured elsewhere, e.g. waiting on the data loader"""
+        if not self.enabled: return
+        r=self.stats.setdefault(self.current,{}).setdefault(name,[0,0])
+        r[0]+=1; r[1]+=t1-t0
+        if len(self.events)<self.trace_limit: self.events.append((name,t0,t1,threading.get_ident(),self.current))
+        else: self.dropped+=1
+        span=self.epochs.setdefault(self.current,[t0,t1])
+        span[0],span[1]=min(span[0],t0),max(span[1],t1)
+
+    def epoch(self,epoch):
+        self.current=epoch
+
+    def totals(self,epoch=None):
+        """{phase: [calls, total seconds]} of one epoch, or of the whole run"""
+        res={}
+        for e,stats in self.stats.items():
+            if epoch is not None and e!=epoch: continue
+            for name,(n,t) in stats.items():
+                r=res.setdefault(name,[0,0.])
+                r[0]+=n; r[1]+=t/1e9
+        return res
+
+    def summary(self,epoch=None):
+        totals=self.totals(epoch)
+        if epoch is None: wall=sum(t1-t0 for t0,t1 in self.epochs.values())/1e9
+        else: wall=(lambda s: (s[1]-s[0])/1e9)(self.epochs.get(epoch,[0,0]))
+        title='all epochs' if epoch is None else 'epoch '+str(epoch)
+        msg='Phase profile ({}, wall {:.2f}s)\n'.format(title,wall)
+        msg+='{:<16}{:>8}{:>12}{:>12}{:>8}\n'.format('phase','calls','total(s)','mean(ms)','%')
+        for name,(n,t) in sorted(totals.items(),key=lambda x:-x[1][1]):
+            msg+='{:<16}{:>8}{:>12.3f}{:>12.3f}{:>8.1f}\n'.format(name,n,t,1e3*t/n,100*t/max(wall,1e-12))
+        return msg
+
+    def export_chrome(self,path):
+        """Chrome trace event format, opens in chrome://tracing and ui.perfetto.dev"""
+        tids={}
+        events=[{'name':name,'ph':'X','ts':t0/1e3,'dur':(t1-t0)/1e3,'pid':0,
+                 'tid':tids.setdefault(tid,len(tids)),'args':{'epoch':e}}
+                for name,t0,t1,tid,e in self.events]
+        if self.dropped: print('Trace: {} intervals after the first {} not exported'.format(self.dropped,self.trace_limit))
+        with open(path,'w') as f: json.dump({'traceEvents':events,'displayTimeUnit':'ms'},f)
+
+prof=PhaseProfiler()
@@ -0,0 +1,123 @@
+import copy
+import torch
+import torch.nn as nn
+from torch.utils.flop_counter import FlopCounterMode
+
+from vision.resnet import ResNet
+from vision.vgg import VGG
+
+
+""" Structured channel pruning of the resnet18 / vgg11 backbones """
+
+def channel_groups(net,emb=None,residual=True):
+    """
+    Channels that have to be pruned together, as (producers, consumers):
+        producers: (conv, bn or None) pairs whose output channels are the group's channels
+        consumers: (conv or linear, block) whose input channels are, block inputs per channel
+    ResNet: the internal channels of every BasicBlock (conv1/bn1 -> conv2) and, with residual,
+    each stage's residual channels, which are shared by the stem or downsample and every
+    conv2/bn2 of the stage and read by the next stage, fc and EmbedLayer.lin.
+    VGG: every make_layers conv -> next conv, the last one -> lin[0] (49 columns per channel).
+    """
+    groups=[]
+    if isinstance(net,ResNet):
+        layers=[net.layer1,net.layer2,net.layer3,net.layer4]
+        for layer in layers:
+            for b in layer: groups.append(([(b.conv1,b.bn1)],[(b.conv2,1)]))
+        if not residual: return groups
+        prod,cons=[(net.conv1,net.bn1)],[]
+        for layer in layers:
+            for i,b in enumerate(layer):
+                cons.append((b.conv1,1))
+                if b.downsample is not None:
+                    cons.append((b.downsample[0],1))
+                    groups.append((prod,cons))
+                    prod,cons=[(b.downsample[0],b.downsample[1])],[]
+                prod.append((b.conv2,b.bn2))
+        cons.append((net.fc,1))
+        if emb is not None: cons.append((emb.lin,1))
+        groups.append((prod,cons))
+    elif isinstance(net,VGG):
+        convs=[m for m in net.features if isinstance(m,nn.Conv2d)]
+        for conv,nxt in zip(convs,convs[1:]): groups.append(([(conv,None)],[(nxt,1)]))
+        groups.append(([(convs[-1],None)],[(net.lin[0],net.lin[0].in_features//convs[-1].out_channels)]))
+    else: raise ValueError('channel pruning supports the resnet and vgg backbones, not '+type(net).__name__)
+    return groups
+
+def bn_scores(prod):
+    """|gamma| of the BN after each conv, the filter L1 norm for convs without BN (vgg11)"""
+    return sum(bn.weight.detach().abs() if bn is not None else conv.weight.detach().abs().sum((1,2,3))
+               for conv,bn in prod)
+
+def taylor_saliency(model,groups,batches,loss_fn):
+    """
+    First-order Taylor importance |sum w*dL/dw| of each output channel's conv filter and BN
+    affine parameters, accumulated over batches; loss_fn(model, x, y) -> loss
+    """
+    training=model.training
+    model.train()
+    scores=[0 for _ in groups]
+    for x,y in batches:
+        model.zero_grad()
+        loss_fn(model,x.cuda(),y.cuda()).backward()
+        for g,(prod,_) in enumerate(groups):
+            s=0
+            for conv,bn in prod:
+                t=(conv.weight*conv.weight.grad).sum((1,2,3))
+                if conv.bias is not None: t=t+conv.bias*conv.bias.grad
+                if bn is not None: t=t+bn.weight*bn.weight.grad+bn.bias*bn.bias.grad
+                s=s+t.detach().abs()
+            scores[g]=scores[g]+s
+    model.zero_grad()
+    model.train(training)
+    return scores
+
+def _prune_out(conv,bn,idx):
+    conv.weight=nn.Parameter(conv.weight.data[idx].clone())
+    if conv.bias is not None: conv.bias=nn.Parameter(conv.bias.data[idx].clone())
+    conv.out_channels=len(idx)
+    if bn is not None:
+        bn.weight=nn.Parameter(bn.weight.data[idx].clone())
+        bn.bias=nn.Parameter(bn.bias.data[idx].clone())
+        bn.running_mean=bn.running_mean[idx].clone()
+        bn.running_var=bn.running_var[idx].clone()
+        bn.num_features=len(idx)
+
+def _prune_in(module,idx,block=1):
+    if block>1: idx=(idx[:,None]*block+torch.arange(block,device=idx.device)).flatten()
+    module.weight=nn.Parameter(module.weight.data[:,idx].clone())
+    if isinstance(module,nn.Conv2d): module.in_channels=len(idx)
+    else: module.in_features=len(idx)
+
+def prune_groups(groups,scores,ratio):
+    """drop the lowest scoring round(ratio*n) channels of every group (at least one is kept)"""
+    for (prod,cons),score in zip(groups,scores):
+        k=max(1,int(round(len(score)*(1-ratio))))
+        idx=torch.sort(torch.topk(score,k).indices).values
+        for conv,bn in prod: _prune_out(conv,bn,idx)
+        for m,block in cons: _prune_in(m,idx,block)
+
+def prune_model(model,ratio,criterion='bn',batches=None,loss_fn=None,residual=True):
+    """
+    Copy of a vision_models model (Vanilla/DCE/ML/PL) with ratio of the backbone's conv channels
+    physically removed, ranked by criterion: 'bn' (BN scale, see bn_scores) or 'grad'
+    (taylor_saliency over batches of (x, y) with loss_fn). The copy has to be fine-tuned;
+    its shapes no longer match the constructors, so save it as a whole module.
+    """
+    assert criterion in ['bn','grad']
+    model=copy.deepcopy(model)
+    groups=channel_groups(model.net,getattr(model,'emb',None),residual)
+    if criterion=='grad': scores=taylor_saliency(model,groups,batches,loss_fn)
+    else: scores=[bn_scores(prod) for prod,_ in groups]
+    with torch.no_grad(): prune_groups(groups,scores,ratio)
+    return model
+
+def count_flops(model,x):
+    """FLOPs of one eval forward on x (2 per multiply-add), as counted by torch's FlopCounterMode"""
+    training=model.training
+    model.eval()
+    with torch.no_grad(), FlopCounterMode(display=False) as counter: model(x)
+    model.train(training)
+    return counter.get_total_flops()
+
+def count_params(model): return sum(p.numel() for p in model.parameters())
@@ -0,0 +1,73 @@
+import io,copy,time
+import torch
+import torch.nn as nn
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx,convert_fx
+
+
+""" Post-training static int8 quantization of backbone + EmbedLayer (CPU) """
+
+class _Body(nn.Module):
+    """the part of a vision_models model that gets quantized: net(x, pred) followed by emb"""
+    def __init__(self,net,emb=None,pred=False):
+        super(_Body, self).__init__()
+        self.net,self.emb,self.pred=net,emb,pred
+    def forward(self,x):
+        x=self.net(x,True) if self.pred else self.net(x)
+        if self.emb is not None: x=self.emb(x)
+        return x
+
+class QuantBackbone(nn.Module):
+    """quantized body in place of model.net, with the backbone's forward(x, pred) signature"""
+    def __init__(self,body):
+        super(QuantBackbone, self).__init__()
+        self.body=body
+    def forward(self,x,pred=False): return self.body(x) # pred is baked into the graph
+
+class CPUModel(nn.Module):
+    """runs a CPU-only (e.g. int8) model for callers that keep inputs on the GPU, such as OOD.cal.testood"""
+    def __init__(self,model):
+        super(CPUModel, self).__init__()
+        self.model=model
+    def cuda(self,device=None): return self
+    def forward(self,x,*args):
+        out=self.model(x.detach().cpu(),*args)
+        if torch.is_tensor(out): return out.to(x.device)
+        return tuple(o.to(x.device) for o in out)
+
+def quantize_model(model,calib,backend='x86'):
+    """
+    int8 copy of a vision_models model: FX graph mode static quantization of backbone and
+    EmbedLayer (the whole of model.net for Vanillamodel), with observers calibrated on the
+    input batches in `calib`. The heads (PL prototypes and distances, DCE centers,
+    linear) stay fp32 on the dequantized embedding, so forward(x) and forward(x, True) keep
+    their signatures. CPU only.
+    """
+    torch.backends.quantized.engine=backend
+    model=copy.deepcopy(model).cpu().eval()
+    emb=getattr(model,'emb',None)
+    body=_Body(model.net,emb,pred=emb is None).eval()
+    calib=[x.cpu() for x in calib]
+    prepared=prepare_fx(body,get_default_qconfig_mapping(backend),(calib[0],))
+    with torch.no_grad():
+        for x in calib: prepared(x)
+    model.net=QuantBackbone(convert_fx(prepared))
+    if emb is not None: model.emb=nn.Identity()
+    return model
+
+def model_size(model):
+    """serialized state_dict size in MB"""
+    buf=io.BytesIO()
+    torch.save(model.state_dict(),buf)
+    return buf.tell()/2**20
+
+def cpu_latency(model,x,warmup=3,iters=10):
+    """median ms of a no-grad forward on the CPU"""
+    model,x=model.eval(),x.cpu()
+    times=[]
+    with torch.no_grad():
+        for i in range(warmup+iters):
+            t=time.perf_counter()
+            model(x)
+            if i>=warmup: times.append(1e3*(time.perf_counter()-t))
+    return sorted(times)[len(times)//2]
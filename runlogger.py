@@ -0,0 +1,68 @@
+import os,json,csv,time,atexit
+from collections import namedtuple
+
+
+""" Buffered run logging: free-form text log plus typed metric records """
+
+Record=namedtuple('Record',['run','epoch','metric','value','time'])
+
+class RunLogger:
+    """
+    Drop-in for trainer.mylogger: info(msg) appends text to `path`, record(run,epoch,metric,value)
+    adds a typed Record written to `path` with the extension replaced by .jsonl or .csv (fmt).
+    Both are buffered in memory and written when `flush_every` entries are pending or
+    `flush_secs` passed since the last write, on flush()/close() and at interpreter exit.
+    mode='w' truncates both files, 'a' appends (sweep workers sharing a log).
+    """
+    def __init__(self,path,mode='w',fmt='jsonl',flush_every=64,flush_secs=30):
+        assert mode in ['w','a'] and fmt in ['jsonl','csv']
+        self.path,self.fmt=path,fmt
+        self.metrics_path=os.path.splitext(path)[0]+'.'+fmt
+        self.flush_every,self.flush_secs=flush_every,flush_secs
+        self.lines,self.records=[],[]
+        self.last=time.time()
+        for p in [self.path,self.metrics_path]:
+            if mode=='w' or not os.path.exists(p): open(p,'w').close()
+        if fmt=='csv' and os.path.getsize(self.metrics_path)==0:
+            with open(self.metrics_path,'w',newline='') as f: csv.writer(f).writerow(Record._fields)
+        atexit.register(self.flush)
+
+    def info(self,msg):
+        self.lines.append(msg)
+        self._maybe_flush()
+
+    def record(self,run,epoch,metric,value):
+        self.records.append(Record(run,epoch,metric,float(value),time.time()))
+        self._maybe_flush()
+
+    def log(self,run,epoch,**metrics):
+        """several metrics of one (run, epoch) at once"""
+        for metric,value in metrics.items(): self.record(run,epoch,metric,value)
+
+    def _maybe_flush(self):
+        if len(self.lines)+len(self.records)>=self.flush_every or time.time()-self.last>=self.flush_secs:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            with open(self.path,'a') as f: f.write(''.join(self.lines))
+            self.lines=[]
+        if self.records:
+            with open(self.metrics_path,'a',newline='') as f:
+                if self.fmt=='jsonl': f.write(''.join(json.dumps(r._asdict())+'\n' for r in self.records))
+                else: csv.writer(f).writerows(self.records)
+            self.records=[]
+        self.last=time.time()
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+
+def load_records(path):
+    """Records of a .jsonl or .csv metrics file"""
+    with open(path,newline='') as f:
+        if path.endswith('.jsonl'): return [Record(**json.loads(l)) for l in f if l.strip()]
+        rows=list(csv.DictReader(f))
+    conv=lambda r: Record(r['run'],int(r['epoch']) if r['epoch'] not in ['','None'] else None,
+                          r['metric'],float(r['value']),float(r['time']))
+    return [conv(r) for r in rows]
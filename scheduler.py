@@ -0,0 +1,99 @@
+import os,json,time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+
+""" Job graph scheduler for experiment sweeps """
+
+class Job:
+    """fn(*args) run in a worker process once all jobs named in deps are done"""
+    def __init__(self,name,fn,args=(),deps=(),threads=1):
+        self.name,self.fn,self.args=name,fn,args
+        self.deps,self.threads=list(deps),threads
+
+def _run(fn,args,threads):
+    import torch
+    torch.set_num_threads(threads)
+    t=time.time()
+    fn(*args)
+    return time.time()-t
+
+class Scheduler:
+    """
+    Runs a job graph on a process pool. A job is started when its dependencies are done and
+    its thread quota fits in the cpus budget. Finished jobs are recorded in the JSON state
+    file, so a restarted sweep skips them; a failed job only cancels its dependents.
+    When a worker dies the pool is shut down and replaced, and the jobs that were in flight
+    on it are resubmitted one at a time: a job that breaks the pool while running alone failed.
+    """
+    def __init__(self,jobs,workers=2,cpus=None,state='sweep_state.json'):
+        self.jobs={j.name:j for j in jobs}
+        self.workers=workers
+        self.cpus=os.cpu_count() if cpus is None else cpus
+        self.state_path=state
+        self.state={}
+        if os.path.isfile(state):
+            with open(state) as f: self.state=json.load(f)
+
+    def _save(self):
+        tmp=self.state_path+'.tmp'
+        with open(tmp,'w') as f: json.dump(self.state,f,indent=1)
+        os.replace(tmp,self.state_path)
+
+    def _ready(self,name):
+        return all(self.state.get(d)=='done' for d in self.jobs[name].deps)
+
+    def _blocked(self,name):
+        return any(self.state.get(d)=='failed' or self._blocked(d) for d in self.jobs[name].deps if d in self.jobs)
+
+    def _pool(self): return ProcessPoolExecutor(self.workers,mp_context=mp.get_context('spawn'))
+
+    def run(self):
+        pending=[n for n in self.jobs if self.state.get(n)!='done']
+        for n in pending: self.state.pop(n,None) # retry failures of a previous run
+        print('Sweep: {} jobs, {} done before'.format(len(self.jobs),len(self.jobs)-len(pending)))
+        pool=self._pool()
+        running,used,suspects={},0,set() # suspects: in flight when a pool broke, run alone
+        while pending or running:
+            for n in [n for n in pending if self._blocked(n)]:
+                pending.remove(n)
+                print('Sweep: skip',n,'(dependency failed)')
+            for n in [n for n in pending if self._ready(n)]:
+                job=self.jobs[n]
+                threads=min(job.threads,self.cpus)
+                if len(running)>=self.workers or used+threads>self.cpus: break
+                if running and (n in suspects or any(r[0] in suspects for r in running.values())): break
+                running[pool.submit(_run,job.fn,job.args,threads)]=(n,threads,pool)
+                used+=threads
+                pending.remove(n)
+                print('Sweep: start',n)
+            if not running: break # nothing can start: unmet dependencies outside the graph
+            done,_=wait(running,return_when=FIRST_COMPLETED)
+            for future in done:
+                if future not in running: continue # already resubmitted with its broken pool
+                n,threads,owner=running.pop(future)
+                used-=threads
+                try:
+                    print('Sweep: done {} ({:.1f}s)'.format(n,future.result()))
+                    self.state[n]='done'
+                except BrokenProcessPool as e: # a worker died: rebuild the pool, retry the jobs it held
+                    broken=[n]+[running[f][0] for f in list(running) if running[f][2] is owner]
+                    for f in [f for f in list(running) if running[f][2] is owner]: used-=running.pop(f)[1]
+                    owner.shutdown(wait=False,cancel_futures=True)
+                    if owner is pool: pool=self._pool()
+                    if len(broken)==1: # it ran alone, so it broke the pool
+                        print('Sweep: failed',n,repr(e))
+                        self.state[n]='failed'
+                    else:
+                        for b in broken: print('Sweep: resubmit',b,'(worker pool broke)')
+                        suspects.update(broken)
+                        pending[:0]=broken
+                except Exception as e:
+                    print('Sweep: failed',n,repr(e))
+                    self.state[n]='failed'
+                self._save()
+        pool.shutdown()
+        failed=[n for n,s in self.state.items() if s=='failed']
+        print('Sweep finished.',len(failed),'failed:',failed)
+        return self.state
@@ -2,7 +2,7 @@ import argparse
 from genericpath import exists
 import os
 import shutil
-import time,random
+import time,random,copy,functools,math
 import logging
 
 import torch
@@ -17,17 +17,29 @@ import torchvision.datasets as datasets
 import vision_models as models
 from ML.triplet_margin_loss import TripletMarginLoss as TML
 from ML.n_pairs_loss import NPairsLoss as NPL
+from ML.xbm import CrossBatchMemory
+from ML.proxy_loss import ProxyLoss
 from pytorch_metric_learning import distances
 import torchattacks
 from OOD.cal import testood
-
-
-class mylogger:
-    def __init__(self,path,mode='w'):
-        self.path=path
-        with open(path,mode) as f: f.write('')
-    def info(self,msg):
-        with open(self.path,'a') as f: f.write(msg) 
+from data_utils import TensorLoader,IndexedDataset,PKBatchSampler
+import torch.distributed as dist
+from AT.free import at_helper
+from AT.pgd import BatchedPGD
+from scheduler import Job,Scheduler
+from checkpoint import CheckpointWriter,atomic_save,rotate_best,snapshot
+from profiling import prof
+from runlogger import RunLogger
+from halving import SuccessiveHalving
+from validation import ValidationPolicy,RobustValidator,subset_loader
+from compiled import compile_model,TracedModel
+from freeze import freeze_model
+from quantize import quantize_model,CPUModel,model_size,cpu_latency
+from distill import Distiller,share_prototypes,source_key
+from prune import prune_model,count_flops,count_params
+from feature_cache import FeatureCache,FeatureLoader,head_model
+
+logger=None # RunLogger, set by __main__ or sweep_job
 
 def name_helper(args):
     if args.loss=='PL':
@@ -39,6 +51,11 @@ def name_helper(args):
         savename=args.model+'-D'+str(args.D)+'_'+args.loss+'_'+args.dataset+'_'+args.group+'-'+args.name
     return savename
 
+def best_path(args,best=1):
+    """the _best<k>.th checkpoint model_loader(eval=True) reads"""
+    save_dir=os.path.join(args.save_dir, 'PL') if args.loss=='PL' else args.save_dir
+    return os.path.join(save_dir, args.group, args.dataset, name_helper(args)+'_best'+str(best)+'.th')
+
 def model_loader(args,model,eval=False,optimizer=None,lr_scheduler=None,best=1):
     best_prec1=0
     args.start_epoch=0
@@ -69,26 +86,7 @@ def model_loader(args,model,eval=False,optimizer=None,lr_scheduler=None,best=1):
         return model,args,best_prec1
 
 
-def main(args, model, attack=None):
-    save_dir=os.path.join(args.save_dir, 'PL') if args.loss=='PL' else args.save_dir
-    save_dir=os.path.join(save_dir, args.group)
-    save_dir=os.path.join(save_dir, args.dataset)
-    if not os.path.exists(save_dir): os.makedirs(save_dir)
-    # model = torch.nn.DataParallel(model)
-    # model.cuda()
-
-    best_prec1=0
-    optimizer = torch.optim.SGD([{'params': model.parameters(), 'initial_lr': args.lr}], args.lr,
-                                momentum=args.momentum,
-                                weight_decay=args.weight_decay)
-    lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer,
-                    milestones=[100, 150], last_epoch=args.start_epoch - 1)
-    # optionally resume from a checkpoint
-    if args.evaluate: model=model_loader(args,model,eval=True,best=args.best)
-    elif args.resume: model,args,best_prec1=model_loader(args,model,False,optimizer,lr_scheduler)
-    
-    cudnn.benchmark = True
-
+def data_helper(args):
     if args.dataset=='cifar':
         # normalize = transforms.Normalize(mean=[0.485, 0.456, 0.406],std=[0.229, 0.224, 0.225])
         d=datasets.CIFAR10(root='./data', train=True, transform=transforms.Compose([
@@ -97,7 +95,8 @@ def main(args, model, attack=None):
                 transforms.ToTensor(),
                 # normalize,
             ]), download=True)
-        indexes=torch.tensor(random.sample(range(d.data.shape[0]),int(args.ratio*d.data.shape[0])))
+        indexes=torch.tensor(sorted(random.sample(range(d.data.shape[0]),int(args.ratio*d.data.shape[0])))) # sorted: index i is the same image across runs at ratio 1
+        if args.AT and args.at_mode=='cache': d.transform=transforms.ToTensor() # crop/flip in train(), see WarmPGD.augment
         d.data=d.data[indexes]
         d.targets=torch.Tensor(d.targets).long().index_select(0,indexes)
         train_loader = torch.utils.data.DataLoader(d,
@@ -115,7 +114,7 @@ def main(args, model, attack=None):
                 # transforms.RandomCrop([54, 54]),
                 transforms.ToTensor(),
             ]), download=True)
-        indexes=torch.tensor(random.sample(range(d.data.shape[0]),int(args.ratio*d.data.shape[0])))
+        indexes=torch.tensor(sorted(random.sample(range(d.data.shape[0]),int(args.ratio*d.data.shape[0]))))
         d.data=d.data[indexes]
         d.labels=torch.Tensor(d.labels).long().index_select(0,indexes)
         train_loader = torch.utils.data.DataLoader(d,
@@ -133,7 +132,7 @@ def main(args, model, attack=None):
                                     transforms.ToTensor(),
                                     # transforms.Normalize((0.1307,), (0.3081,))
                             ]))
-        indexes=torch.tensor(random.sample(range(d.data.shape[0]),int(args.ratio*d.data.shape[0])))
+        indexes=torch.tensor(sorted(random.sample(range(d.data.shape[0]),int(args.ratio*d.data.shape[0]))))
         d.data=d.data.index_select(0,indexes)
         d.targets=d.targets.index_select(0,indexes)
         train_loader = torch.utils.data.DataLoader(d,
@@ -147,58 +146,196 @@ def main(args, model, attack=None):
                             ])),
             batch_size=args.batch_size, shuffle=False,
             num_workers=args.workers, pin_memory=True)
+    sampler=pk_sampler(args,d)
+    if args.dataset in args.tensor_data: 
+        train_loader,val_loader=tensor_loader_helper(args,d,val_loader.dataset,sampler)
+    elif args.AT and args.at_mode=='cache' or args.distill or sampler is not None: # yield sample indices for the warm-start / teacher cache
+        train_loader = torch.utils.data.DataLoader(IndexedDataset(d) if args.AT and args.at_mode=='cache' or args.distill else d,
+            batch_size=1 if sampler is not None else args.batch_size, shuffle=sampler is None, batch_sampler=sampler,
+            num_workers=args.workers, pin_memory=True)
+    return train_loader,val_loader
+
+def pk_sampler(args,d):
+    """P x K class-balanced batches for TLA/NLA with --pk-classes, sharded over torch.distributed ranks"""
+    if not args.pk_classes or args.loss not in ['TLA','NLA']: return None
+    labels=d.labels if args.dataset=='svhn' else d.targets
+    replicas,rank=(dist.get_world_size(),dist.get_rank()) if dist.is_available() and dist.is_initialized() else (1,0)
+    return PKBatchSampler(labels,args.pk_classes,args.pk_samples,replicas,rank)
+
+def tensor_loader_helper(args,d,val_d,sampler=None):
+    # whole dataset as one uint8 tensor, crop/flip/ToTensor done per batch
+    targets=lambda d: d.labels if args.dataset=='svhn' else d.targets
+    device=args.tensor_device
+    train_loader=TensorLoader(d.data,targets(d),args.batch_size,shuffle=True,
+        augment=args.dataset=='cifar' and not (args.AT and args.at_mode=='cache'),device=device,background=device=='cpu',
+        indices=args.AT and args.at_mode=='cache' or args.distill,batch_sampler=sampler)
+    val_loader=TensorLoader(val_d.data,targets(val_d),args.batch_size,device=device)
+    return train_loader,val_loader
+
+def main(args, model, attack=None, distiller=None):
+    save_dir=os.path.join(args.save_dir, 'PL') if args.loss=='PL' else args.save_dir
+    save_dir=os.path.join(save_dir, args.group)
+    save_dir=os.path.join(save_dir, args.dataset)
+    if not os.path.exists(save_dir): os.makedirs(save_dir)
+    # model = torch.nn.DataParallel(model)
+    # model.cuda()
+
+    best_prec1=0
+    epochs,milestones=args.epochs,[100, 150]
+    if args.AT and args.at_mode=='free': # every replay is an SGD step: as many steps as clean training
+        epochs,milestones=math.ceil(epochs/args.replays),[math.ceil(m/args.replays) for m in milestones]
+    optimizer = torch.optim.SGD([{'params': model.parameters(), 'initial_lr': args.lr}], args.lr,
+                                momentum=args.momentum,
+                                weight_decay=args.weight_decay)
+    lr_scheduler = torch.optim.lr_scheduler.MultiStepLR(optimizer,
+                    milestones=milestones, last_epoch=args.start_epoch - 1)
+    # optionally resume from a checkpoint
+    if args.evaluate: model=model_loader(args,model,eval=True,best=args.best)
+    elif args.resume: model,args,best_prec1=model_loader(args,model,False,optimizer,lr_scheduler)
+    
+    cudnn.benchmark = True
+
+    train_loader,val_loader=data_helper(args)
+    adv_trainer=None
+    if args.AT:
+        n=len(train_loader.data) if isinstance(train_loader,TensorLoader) else len(train_loader.dataset)
+        cache_path=os.path.join(save_dir, name_helper(args)+'_advcache.npy') if args.cache_mmap else None
+        adv_trainer=at_helper(args,model,n,cache_path)
+    if distiller: distiller.prepare(train_loader,args.ratio==1)
 
     if args.evaluate:
         print('Evaluating...')
         top1=validate(args, val_loader, model)
         msg_a=' Accuracy {:.3f}'.format(top1)
+        if logger: logger.record(name_helper(args),None,'clean',top1)
         msg_r=''
         if attack: 
             top1=validate(args, val_loader, model, attack)
             msg_r=' Robustness {:.3f}'.format(top1)
+            if logger: logger.record(name_helper(args),None,'robust/'+args.atk,top1)
         return msg_a,msg_r
 
+    writer=CheckpointWriter() if args.async_save else None
+    policy=ValidationPolicy(val_loader,args.val_subset,args.val_every,args.val_full,best_prec1)
+    robust_bg=RobustValidator(robust_job,args) if attack and args.robust_val=='async' else None
+    savename=name_helper(args)
+    def promote(results): # background robust results, in epoch order
+        for e,p,r,path in results:
+            print('Epoch',e+1,'robustness {:.3f} (background)'.format(r))
+            if logger: logger.record(savename,e,'val_robust',r)
+            if policy.update(p+r): 
+                rotate_best(save_dir,savename,args.max_best)
+                os.replace(path,os.path.join(save_dir, savename+'_best1.th'))
+            else: os.remove(path)
     ts=time.time()
-    for epoch in range(args.start_epoch, args.epochs):
-        te=time.time()
-        # train for one epoch
-        print('current lr {:.5e}'.format(optimizer.param_groups[0]['lr']))
-        train(args, train_loader, model, optimizer, epoch, attack)
-        lr_scheduler.step()
-
-        # evaluate on validation set
-        prec1 = validate(args, val_loader, model)
-        robust=0
-        if attack: robust=validate(args, val_loader, model, attack)
-
-        # remember best prec@1 and save checkpoint
-        is_best = prec1+robust > best_prec1
-        best_prec1 = max(prec1+robust, best_prec1)
-        print('Epoch',epoch+1,'/',args.epochs,'time:',time.time()-te)
-
-        savename=name_helper(args)
-        save_checkpoint({
-            'epoch': epoch + 1,
-            'state_dict': model.state_dict(),
-            'best_prec1': best_prec1,
-            'optimizer': optimizer.state_dict(),
-            'scheduler': lr_scheduler.state_dict(),
-        }, filename=os.path.join(save_dir, savename+'_checkpoint.th'))
-
-        if is_best: best_saver(save_dir,model,savename,args.max_best)
+    try: # a failed epoch still writes the checkpoints already queued
+        for epoch in range(args.start_epoch, epochs):
+            te=time.time()
+            prof.epoch(epoch)
+            if isinstance(train_loader.batch_sampler,PKBatchSampler): train_loader.batch_sampler.set_epoch(epoch)
+            # train for one epoch
+            lr=optimizer.param_groups[0]['lr']
+            print('current lr {:.5e}'.format(lr))
+            train_loss,train_prec1,train_robust=train(args, train_loader, model, optimizer, epoch, attack, adv_trainer, distiller)
+            if args.AT and args.at_mode=='cache': adv_trainer.cache.flush()
+            lr_scheduler.step()
+
+            # evaluate on validation set
+            is_best,validated=False,policy.due(epoch,epochs)
+            if validated and robust_bg: # clean now, robust from a snapshot in the background
+                prec1,_,selected,_=policy.run(lambda loader: (validate(args, loader, model),0),select=False)
+                if selected: 
+                    path=os.path.join(save_dir, savename+'_ep'+str(epoch)+'.th')
+                    submit=functools.partial(robust_bg.submit,epoch,prec1,path,policy.selection_indices)
+                    if writer: writer.save({'state_dict': model.state_dict()},path,args.best_fp16,done=submit)
+                    else: 
+                        atomic_save(snapshot({'state_dict': model.state_dict()},args.best_fp16),path)
+                        submit()
+                promote(robust_bg.poll())
+            elif validated:
+                evaluate=lambda loader: (validate(args, loader, model), validate(args, loader, model, attack) if attack else 0)
+                prec1,robust,_,is_best=policy.run(evaluate)
+
+            # remember best prec@1 and save checkpoint
+            best_prec1 = policy.best
+            print('Epoch',epoch+1,'/',epochs,'time:',time.time()-te)
+            if prof.enabled: print(prof.summary(epoch))
+
+            if logger: 
+                logger.log(savename,epoch,lr=lr,train_loss=train_loss,train_prec1=train_prec1,
+                        train_robust=train_robust,epoch_time=time.time()-te)
+                if validated: logger.record(savename,epoch,'val_prec1',prec1)
+                if validated and not robust_bg: logger.record(savename,epoch,'val_robust',robust)
+            save_checkpoint({
+                'epoch': epoch + 1,
+                'state_dict': model.state_dict(),
+                'best_prec1': best_prec1,
+                'optimizer': optimizer.state_dict(),
+                'scheduler': lr_scheduler.state_dict(),
+            }, filename=os.path.join(save_dir, savename+'_checkpoint.th'), writer=writer)
+
+            if is_best: best_saver(save_dir,model,savename,args.max_best,writer,args.best_fp16)
+    finally:
+        if writer: writer.close()
+    if robust_bg: # wait for the pending robust results, they can raise the best after the last checkpoint
+        promote(robust_bg.close())
+        if policy.best!=best_prec1: # keep the checkpoint's best_prec1 (resume, checkpoint_score) up to date
+            best_prec1=policy.best
+            path=os.path.join(save_dir, savename+'_checkpoint.th')
+            if os.path.isfile(path):
+                checkpoint=torch.load(path,map_location='cpu')
+                checkpoint['best_prec1']=best_prec1
+                atomic_save(checkpoint,path)
     print('Accomplished. Total time:',time.time()-ts)
+    if prof.enabled: 
+        print(prof.summary())
+        prof.export_chrome(os.path.join(save_dir, name_helper(args)+'_trace.json'))
+        prof.reset()
+    return best_prec1
+
+_robust_ctx=None # model, loader and attack of a RobustValidator worker
+
+def robust_job(job_args,path,indices=None):
+    """robust accuracy of a saved state_dict, run in the RobustValidator process"""
+    global args,_robust_ctx
+    args=job_args
+    if _robust_ctx is None:
+        model=model_helper(args)
+        _,val_loader=data_helper(args)
+        if indices is not None: val_loader=subset_loader(val_loader,indices)
+        _robust_ctx=model,val_loader,atk_helper(args,model,args.eps)
+    model,val_loader,attack=_robust_ctx
+    model.load_state_dict(torch.load(path,map_location='cpu')['state_dict'])
+    return validate(args,val_loader,model,attack)
+
+def best_saver(save_dir,model,savename,max_best=3,writer=None,half=False):
+    state={'state_dict': model.state_dict(),}
+    if writer: return writer.save_best(state,save_dir,savename,max_best,half)
+    rotate_best(save_dir,savename,max_best)
+    atomic_save(snapshot(state,half) if half else state, os.path.join(save_dir, savename+'_best1.th'))
+
+
+def loss_helper(args, model, input_var, target_var, adversarial_inputs=None):
+    output_adv=None
+    if args.loss=='DCE':
+        with prof.phase('forward'): features, centers, output= model(input_var,True)
+        with prof.phase('loss'): loss=model.loss(output,target_var,features,centers) 
+    elif args.loss in ['TLA','NLA','PXA']:
+        with prof.phase('forward'): output, embeds= model(input_var,True)
+        with prof.phase('loss'): loss=model.loss(output,embeds,target_var)
+    elif args.loss=='PL':
+        with prof.phase('forward'): output, distance, x= model(input_var,True)
+        if adversarial_inputs is not None and args.adv_norm:
+            with prof.phase('forward'): output_adv, distance_adv, x_adv= model(adversarial_inputs,True)
+            with prof.phase('loss'): loss=model.loss(output,x,distance,target_var,x_adv,option=args.ploption)
+        else: 
+            with prof.phase('loss'): loss=model.loss(output,x,distance,target_var,option=args.ploption)
+    else:
+        with prof.phase('forward'): output = model(input_var)
+        with prof.phase('loss'): loss = model.loss(output, target_var)
+    return output,loss,output_adv
 
-def best_saver(save_dir,model,savename,max_best=3):
-    for i in range(max_best):
-        if not os.path.exists(os.path.join(save_dir, savename+'_best'+str(max_best-i)+'.th')): continue
-        if i==0: os.remove(os.path.join(save_dir, savename+'_best'+str(max_best-i)+'.th'))
-        else: os.rename(os.path.join(save_dir, savename+'_best'+str(max_best-i)+'.th'),
-                        os.path.join(save_dir, savename+'_best'+str(max_best-i+1)+'.th'))
-    save_checkpoint({'state_dict': model.state_dict(),}, 
-        filename=os.path.join(save_dir, savename+'_best1.th'))
-
-
-def train(args, train_loader, model, optimizer, epoch, attack=None):
+def train(args, train_loader, model, optimizer, epoch, attack=None, adv_trainer=None, distiller=None):
     """
         Run one train epoch
     """
@@ -212,49 +349,58 @@ def train(args, train_loader, model, optimizer, epoch, attack=None):
     model.train()
 
     end = time.time()
-    for i, (input, target) in enumerate(train_loader):
+    t_data = time.perf_counter_ns()
+    for i, batch in enumerate(train_loader):
+        if len(batch)==3: index,input,target=batch # indexed for the warm-start / teacher cache
+        else: (input,target),index=batch,None
 
         # measure data loading time
         data_time.update(time.time() - end)
+        prof.record('data', t_data, time.perf_counter_ns())
 
-        target = target.cuda()
-        input_var = input.cuda()
+        with prof.phase('to_device'):
+            target = target.cuda()
+            input_var = input.cuda()
+        grid=None
+        if args.AT and attack and args.at_mode=='cache': input_var,grid=adv_trainer.augment(input_var)
         target_var = target
         bs=input.size(0)
 
         # compute output
-        adversarial_inputs=None
-        if args.AT and attack:
-            model.eval()
+        if args.AT and attack and args.at_mode in ['free','fast']:
+            # free/fast AT: the perturbation is updated from the training backward passes
             if args.loss=='PL' and args.adv_norm:
-                adversarial_inputs = attack(input_var, target_var)
+                adv_loss=lambda x_adv: loss_helper(args,model,input_var,target_var,x_adv)
+                output,loss,output_adv=adv_trainer.train_step(model,optimizer,input_var,adv_loss)
             else:
-                adversarial_inputs = attack(input_var[bs//2:], target_var[bs//2:])
-                input_var = torch.cat((input_var[:bs//2], adversarial_inputs), dim=0)
-                # target_var=torch.cat((target_var, target_var), dim=0)
-            model.train()
-
-        if args.loss=='DCE':
-            features, centers, output= model(input_var,True)
-            loss=model.loss(output,target_var,features,centers) 
-        elif args.loss in ['TLA','NLA']:
-            output, embeds= model(input_var,True)
-            loss=model.loss(output,embeds,target_var)
-        elif args.loss=='PL':
-            output, distance, x= model(input_var,True)
-            if args.AT and attack and args.adv_norm:
-                output_adv, distance_adv, x_adv= model(adversarial_inputs,True)
-                loss=model.loss(output,x,distance,target_var,x_adv,option=args.ploption)
-            else: 
-                loss=model.loss(output,x,distance,target_var,option=args.ploption)
+                adv_loss=lambda x_adv: loss_helper(args,model,torch.cat((input_var[:bs//2],x_adv),dim=0),target_var)
+                output,loss,output_adv=adv_trainer.train_step(model,optimizer,input_var[bs//2:],adv_loss)
+        elif distiller: # PL student on the cached teacher outputs
+            with prof.phase('forward'): output, distance, x= model(input_var,True)
+            with prof.phase('loss'): loss=distiller.loss(model,x,distance,target_var,index,args.ploption)
+            optimizer.zero_grad()
+            with prof.phase('backward'): loss.backward()
+            with prof.phase('step'): optimizer.step()
         else:
-            output = model(input_var)
-            loss = model.loss(output, target_var)
-
-        # compute gradient and do SGD step
-        optimizer.zero_grad()
-        loss.backward()
-        optimizer.step()
+            adversarial_inputs=None
+            if args.AT and attack:
+                with prof.phase('attack'):
+                    model.eval()
+                    if index is None: atk=lambda x,y,s: attack(x,y)
+                    else: atk=lambda x,y,s: adv_trainer(x,y,index[s],None if grid is None else (grid[0][s],grid[1][s])) # warm-started from the cache
+                    if args.loss=='PL' and args.adv_norm:
+                        adversarial_inputs = atk(input_var, target_var, slice(None))
+                    else:
+                        adversarial_inputs = atk(input_var[bs//2:], target_var[bs//2:], slice(bs//2,None))
+                        input_var = torch.cat((input_var[:bs//2], adversarial_inputs), dim=0)
+                        # target_var=torch.cat((target_var, target_var), dim=0)
+                    model.train()
+            output,loss,output_adv=loss_helper(args,model,input_var,target_var,adversarial_inputs)
+
+            # compute gradient and do SGD step
+            optimizer.zero_grad()
+            with prof.phase('backward'): loss.backward()
+            with prof.phase('step'): optimizer.step()
 
         output = output.float()
         loss = loss.float()
@@ -271,12 +417,14 @@ def train(args, train_loader, model, optimizer, epoch, attack=None):
         else:
             prec1 = accuracy(output.data, target_var)[0]
 
-        losses.update(loss.item(), bs)
-        top1.update(prec1.item(), bs)
+        with prof.phase('metrics'):
+            losses.update(loss.item(), bs)
+            top1.update(prec1.item(), bs)
 
         # measure elapsed time
         batch_time.update(time.time() - end)
         end = time.time()
+        t_data = time.perf_counter_ns()
 
         if i % args.print_freq == 0:
             print('Epoch: [{0}][{1}/{2}]\t'
@@ -286,6 +434,7 @@ def train(args, train_loader, model, optimizer, epoch, attack=None):
                   'Robust {robust.val:.4f} ({robust.avg:.4f})'.format(
                       epoch, i, len(train_loader), batch_time=batch_time,
                       loss=losses, top1=top1,robust=robust))
+    return losses.avg,top1.avg,robust.avg
 
 
 def validate(args, val_loader, model, attack=None):
@@ -297,14 +446,17 @@ def validate(args, val_loader, model, attack=None):
 
     model.eval()
     end = time.time()
+    t_data = time.perf_counter_ns()
     for i, (input, target) in enumerate(val_loader):
+        prof.record('val/data', t_data, time.perf_counter_ns())
         target = target.cuda()
         input_var = input.cuda()
         target_var = target.cuda()
 
-        if attack: input_var = attack(input_var, target_var)
+        if attack: 
+            with prof.phase('val/attack'): input_var = attack(input_var, target_var)
 
-        with torch.no_grad():
+        with torch.no_grad(), prof.phase('val/forward'):
             output = model(input_var)
 
         output = output.float()
@@ -314,13 +466,16 @@ def validate(args, val_loader, model, attack=None):
         # measure elapsed time
         batch_time.update(time.time() - end)
         end = time.time()
+        t_data = time.perf_counter_ns()
 
     if not attack: msg=' Accuracy {top1.avg:.3f}'.format(top1=top1)
     else: msg=' Robustness {top1.avg:.3f}'.format(top1=top1)
     print(msg)
     return top1.avg
 
-def save_checkpoint(state, filename='checkpoint.pth.tar'): torch.save(state, filename)
+def save_checkpoint(state, filename='checkpoint.pth.tar', writer=None): 
+    if writer: writer.save(state, filename) # returns once the state is copied to host memory
+    else: atomic_save(state, filename)
 
 class AverageMeter(object):
     """Computes and stores the average and current value"""
@@ -363,25 +518,38 @@ def atk_helper(args,model,eps,steps=20):
     if args.atk=='pgdrs': return torchattacks.PGD(model, eps=eps, alpha=2/255, steps=7,random_start=True)
     elif args.atk=='fgsm': return torchattacks.FGSM(model, eps=eps)
     elif args.atk=='bim': return torchattacks.BIM(model, eps=eps, alpha=1/255, steps=steps)
+    elif args.atk=='apgd': return torchattacks.APGD(model, eps=eps, steps=steps)
+    elif args.atk=='npgd': return BatchedPGD(model, eps, alpha=2/255, steps=steps)
+    elif args.atk=='pgdd': return BatchedPGD(model, eps, alpha=2/255, steps=steps, objective='distance')
     else: print('No attack.'); return None
 
+def ar_eps(args,eps):
+    """the budgets an AR test attacks with: every --eps-factors multiple of eps for the batched PGDs"""
+    return [f*eps for f in args.eps_factors] if args.atk in ['npgd','pgdd'] else eps
+
+def eps_name(name,eps): return '{}@{:.3f}'.format(name,eps)
+
 def model_helper(args):
-    assert args.loss in ['DCE','vanilla','PL','TLA','NLA']
+    assert args.loss in ['DCE','vanilla','PL','TLA','NLA','PXA']
     if args.loss=='DCE': print('Using DCE Loss')
     elif args.loss=='PL': print('Using PL Loss')
     elif args.loss=='TLA': print('Using Triplet Loss')
     elif args.loss=='NLA': print('Using N-pair Loss')
+    elif args.loss=='PXA': print('Using Proxy-'+args.proxy_mode+' Loss')
     elif args.loss=='vanilla': print('Using Vanilla model')
     modelname='conv' if args.dataset=='mnist' else args.model 
     print('Using',modelname,'model')
+    memory=CrossBatchMemory(args.xbm) if args.xbm else None # TLA/NLA
     if args.loss=='DCE': return models.DCEmodel(modelname,args.D).cuda()
     elif args.loss=='PL': return models.PLmodel(modelname,args.C,args.D,args.lossdist,args.normdist,args.preddist).cuda()
-    elif args.loss=='TLA': return models.MLmodel(TML(),modelname,args.D).cuda()
-    elif args.loss=='NLA': return models.MLmodel(NPL(),modelname,args.D).cuda()
+    elif args.loss=='TLA': return models.MLmodel(TML(mining=args.mining,memory=memory),modelname,args.D).cuda()
+    elif args.loss=='NLA': return models.MLmodel(NPL(memory=memory),modelname,args.D).cuda()
+    elif args.loss=='PXA': return models.MLmodel(ProxyLoss(10,args.D,args.C,args.proxy_mode),modelname,args.D).cuda()
     elif args.loss=='vanilla': return models.Vanillamodel(modelname).cuda()
 
 
 def AR_test(atks,losses,dataset,backbones):
+    if args.single_pass: return AR_table(atks,losses,dataset,backbones)
     msg='\n'+'*'*50+'\nAdversarial robustness test start.\n'
     print(msg)
     logger.info(msg)
@@ -410,11 +578,203 @@ def AR_test(atks,losses,dataset,backbones):
                     logger.info(msg)
                     args.loss=i
                     model=model_helper(args)
-                    atk=atk_helper(args,model,eps)
-                    msg_a,msg_r=main(args,model,atk)
+                    atk=atk_helper(args,model,ar_eps(args,eps))
+                    if isinstance(atk,BatchedPGD) and len(atk.eps)>1: # every budget from one invocation per batch
+                        model=model_loader(args,model,eval=True,best=args.best)
+                        _,val_loader=data_helper(args)
+                        top1,robust=atk.robustness(val_loader)
+                        msg_a=' Accuracy {:.3f}'.format(top1)
+                        msg_r=''.join(' Robustness@{:.3f} {:.3f}'.format(e,r) for e,r in robust.items())
+                        print(msg_a+msg_r)
+                        for e,r in robust.items(): logger.record(name_helper(args),None,'robust/'+eps_name(args.atk,e),r)
+                    else: msg_a,msg_r=main(args,model,atk)
                     logger.info(msg_a)
                     logger.info(msg_r)
     
+def AR_table(atks,losses,dataset,backbones):
+    """AR_test that loads data and every checkpoint once and runs all attacks per test batch"""
+    msg='\n'+'*'*50+'\nAdversarial robustness test start (single pass).\n'
+    print(msg)
+    logger.info(msg)
+    args.evaluate=True
+    for d in dataset:
+        args.dataset=d
+        if d=='mnist': args.epochs=10;eps=0.3;backbone=['conv']
+        if d=='cifar': args.epochs=200;eps=8/255;backbone=backbones
+        if d=='svhn': args.epochs=200;eps=8/255;backbone=backbones
+        _,val_loader=data_helper(args)
+        for m in backbone:
+            if d!='mnist' and m=='conv': continue
+            args.model=m
+            rows=[]
+            for i in losses:
+                args.loss=i
+                model=model_helper(args)
+                model=model_loader(args,model,eval=True,best=args.best)
+                if args.compile: model=TracedModel(model)
+                attacks=[]
+                for args.atk in atks: attacks.append((args.atk,atk_helper(args,model,ar_eps(args,eps))))
+                res=evaluate_attacks(args,val_loader,model,attacks)
+                rows.append((i,res))
+                for name,value in res.items(): 
+                    logger.record(name_helper(args),None,name if name=='clean' else 'robust/'+name,value)
+            msg='\n===================== Dataset: '+d+' | Backbone: '+m+' =====================\n'
+            msg+=table_msg(list(rows[0][1]),rows)
+            print(msg)
+            logger.info(msg)
+
+def evaluate_attacks(args, val_loader, model, attacks):
+    """
+    Clean accuracy and robustness under each (name, attack) from one pass over val_loader,
+    a multi-eps BatchedPGD reports every budget as name@eps
+    """
+    meters={'clean':AverageMeter()}
+    for name,attack in attacks: 
+        if isinstance(attack,BatchedPGD) and len(attack.eps)>1:
+            for e in attack.eps: meters[eps_name(name,e)]=AverageMeter()
+        else: meters[name]=AverageMeter()
+    model.eval()
+    for i, (input, target) in enumerate(val_loader):
+        target = target.cuda()
+        input_var = input.cuda()
+        with torch.no_grad(): output = model(input_var)
+        meters['clean'].update(accuracy(output.float().data, target)[0].item(), input.size(0))
+        for name,attack in attacks:
+            if isinstance(attack,BatchedPGD) and len(attack.eps)>1: # every budget in one invocation
+                _,correct=attack.evaluate(input_var, target)
+                for e,c in zip(attack.eps,correct): meters[eps_name(name,e)].update(100*c/input.size(0), input.size(0))
+                continue
+            adversarial_inputs = attack(input_var, target)
+            with torch.no_grad(): output = model(adversarial_inputs)
+            meters[name].update(accuracy(output.float().data, target)[0].item(), input.size(0))
+    return {name:meter.avg for name,meter in meters.items()}
+
+def table_msg(cols,rows):
+    w=max([10]+[len(loss)+2 for loss,_ in rows])
+    msg='Loss'.ljust(w)+''.join('{:>10}'.format(c.upper()) for c in cols)+'\n'
+    for loss,res in rows: msg+=loss.ljust(w)+''.join('{:>10.3f}'.format(res[c]) for c in cols)+'\n'
+    return msg
+    
+def PTQ_test(atks,ood_dataset,losses,dataset,backbones):
+    """
+    int8 post-training quantization of the trained models: accuracy, transfer robustness
+    (attacks crafted on the fp32 model), OOD metrics, CPU latency and size next to fp32
+    """
+    msg='\n'+'*'*50+'\nInt8 PTQ test start.\n'
+    print(msg)
+    logger.info(msg)
+    args.evaluate=True
+    for d in dataset:
+        args.dataset=d
+        if d=='mnist': args.epochs=10;eps=0.3;backbone=['conv']
+        if d=='cifar': args.epochs=200;eps=8/255;backbone=backbones
+        if d=='svhn': args.epochs=200;eps=8/255;backbone=backbones
+        train_loader,val_loader=data_helper(args)
+        calib=[]
+        for batch in train_loader:
+            calib.append(batch[-2]) # (index,) input, target
+            if len(calib)==args.calib_batches: break
+        for m in backbone:
+            if d!='mnist' and m=='conv': continue
+            args.model=m
+            rows=[]
+            for i in losses:
+                args.loss=i
+                model=model_helper(args)
+                model=model_loader(args,model,eval=True,best=args.best)
+                model.eval()
+                qmodel=quantize_model(model,calib)
+                attacks=[]
+                for args.atk in atks: attacks.append((args.atk,atk_helper(args,model,eps)))
+                res=evaluate_transfer(val_loader,{'fp32':model,'int8':CPUModel(qmodel)},attacks)
+                x=calib[0]
+                for name,net in [('fp32',copy.deepcopy(model).cpu()),('int8',qmodel)]:
+                    res[name]['ms']=cpu_latency(net,x)
+                    res[name]['MB']=model_size(net)
+                    rows.append((i+'-'+name,res[name]))
+                    for k,v in res[name].items(): logger.record(name_helper(args),None,'ptq/'+name+'/'+k,v)
+                if d=='mnist': continue
+                expname=name_helper(args)
+                for dataname in ood_dataset:
+                    if dataname in ['cifar','svhn']: continue # PGD on the OOD inputs needs gradients
+                    msg,scores=testood(expname+'_int8',CPUModel(qmodel),dataname,args.workers,d,ret_scores=True)
+                    logger.info('Int8 '+i+'\n'+msg)
+                    for k,v in scores.items(): logger.record(expname,None,'ptq/int8/ood/'+dataname+'/'+k,v)
+            msg='\n===================== PTQ | Dataset: '+d+' | Backbone: '+m+' =====================\n'
+            msg+=table_msg(['clean']+atks+['ms','MB'],rows)
+            print(msg)
+            logger.info(msg)
+
+def evaluate_transfer(val_loader, models, attacks):
+    """
+    {model name: {'clean' and attack name: accuracy}}; adversarial inputs are crafted once per
+    batch by each (name, attack) against its own (fp32) model and fed to all models
+    """
+    meters={n:{a:AverageMeter() for a in ['clean']+[a for a,_ in attacks]} for n in models}
+    for i, (input, target) in enumerate(val_loader):
+        target = target.cuda()
+        input_var = input.cuda()
+        inputs=[('clean',input_var)]+[(name,attack(input_var, target)) for name,attack in attacks]
+        for a,x in inputs:
+            for n,model in models.items():
+                with torch.no_grad(): output = model(x)
+                meters[n][a].update(accuracy(output.float().data, target)[0].item(), input.size(0))
+    return {n:{a:meter.avg for a,meter in m.items()} for n,m in meters.items()}
+
+def prune_test(losses,dataset,backbones):
+    """
+    Structured channel pruning of the trained resnet/vgg models at each of args.prune_ratios,
+    fine-tuned with train() for args.prune_epochs: accuracy, FLOPs, parameters, CPU latency and
+    size per ratio (ratio 0 is the unpruned model). Pruned models are saved as whole modules.
+    """
+    msg='\n'+'*'*50+'\nChannel pruning test start.\n'
+    print(msg)
+    logger.info(msg)
+    args.evaluate=True
+    for d in dataset:
+        args.dataset=d
+        if d=='mnist': continue # ConvNet is not pruned
+        if d=='cifar': args.epochs=200;eps=8/255;backbone=backbones
+        if d=='svhn': args.epochs=200;eps=8/255;backbone=backbones
+        args.eps=eps
+        train_loader,val_loader=data_helper(args)
+        batches=[]
+        for batch in train_loader:
+            batches.append((batch[-2],batch[-1])) # (index,) input, target
+            if len(batches)==args.calib_batches: break
+        x=batches[0][0]
+        for m in backbone:
+            if m not in ['resnet','vgg']: continue
+            args.model=m
+            rows=[]
+            for i in losses:
+                args.loss=i
+                model=model_helper(args)
+                model=model_loader(args,model,eval=True,best=args.best)
+                save_dir=os.path.join(args.save_dir,'PL' if i=='PL' else '',args.group,d)
+                for r in [0]+args.prune_ratios:
+                    pruned=model
+                    if r: 
+                        loss_fn=lambda net,input,target: loss_helper(args,net,input,target)[1]
+                        pruned=prune_model(model,r,args.prune_criterion,batches,loss_fn)
+                        optimizer=torch.optim.SGD(pruned.parameters(),args.prune_lr,
+                                                  momentum=args.momentum,weight_decay=args.weight_decay)
+                        attack=atk_helper(args,pruned,eps) if args.AT else None
+                        n=len(train_loader.data) if isinstance(train_loader,TensorLoader) else len(train_loader.dataset)
+                        adv_trainer=at_helper(args,pruned,n) if args.AT else None
+                        for epoch in range(args.prune_epochs): train(args,train_loader,pruned,optimizer,epoch,attack,adv_trainer)
+                        torch.save(pruned,os.path.join(save_dir,name_helper(args)+'_pruned'+str(r)+'.pt'))
+                    res={'clean':validate(args,val_loader,pruned),'MFLOPs':count_flops(pruned,x.cuda())/1e6,
+                         'Mparams':count_params(pruned)/1e6}
+                    cpu=copy.deepcopy(pruned).cpu()
+                    res['ms'],res['MB']=cpu_latency(cpu,x),model_size(cpu)
+                    rows.append((i+'-p'+str(r),res))
+                    for k,v in res.items(): logger.record(name_helper(args),None,'prune/'+str(r)+'/'+k,v)
+            msg='\n===================== Pruning ('+args.prune_criterion+') | Dataset: '+d+' | Backbone: '+m+' =====================\n'
+            msg+=table_msg(['clean','MFLOPs','Mparams','ms','MB'],rows)
+            print(msg)
+            logger.info(msg)
+
 def OOD_test(ood_dataset,losses,dataset,backbones):
     msg='\n'+'*'*50+'\nOOD robustness test start.\n'
     print(msg)
@@ -441,8 +801,10 @@ def OOD_test(ood_dataset,losses,dataset,backbones):
                     model=model_loader(args,model,eval=True) # it will load model based on args
                     expname=name_helper(args)
                     model.eval()
-                    msg=testood(expname,model,dataname,args.workers,indis)
+                    if args.freeze: model=freeze_model(model,torch.rand(8,3,32,32).cuda())
+                    msg,scores=testood(expname,model,dataname,args.workers,indis,ret_scores=True)
                     logger.info(msg)
+                    for k,v in scores.items(): logger.record(expname,None,'ood/'+dataname+'/'+k,v)
                     
 def trainer(args,losses,dataset,backbones):
     print('\n','*'*50,'\nTraining start.\n')
@@ -453,6 +815,7 @@ def trainer(args,losses,dataset,backbones):
         if d=='mnist': args.epochs=10;eps=0.3;backbone=['conv']
         if d=='cifar': args.epochs=200;eps=8/255;backbone=backbones
         if d=='svhn': args.epochs=200;eps=8/255;backbone=backbones
+        args.eps=eps
         for m in backbone:
             if d!='mnist' and m=='conv': continue
             args.model=m
@@ -460,13 +823,191 @@ def trainer(args,losses,dataset,backbones):
             for i in losses:
                 print('______________________ Loss: '+i+' ____________________')
                 args.loss=i
-                atk=None
-                if args.AT:
-                    print('Attack: '+args.atk.upper())
-                    args.batch_size=64 if i=='TLA' else 256
-                    atk=atk_helper(args,eps)
-                model=model_helper(args)
-                main(args,model,atk)
+                train_config(args,eps)
+
+def train_config(args,eps):
+    """build model and attack for the configured dataset/backbone/loss and train, returns best_prec1"""
+    atk=None
+    model=model_helper(args)
+    if args.compile: model=compile_model(model,args.compile)
+    if args.AT:
+        print('Attack: '+args.atk.upper()+' ('+args.at_mode+' AT)')
+        args.batch_size=64 if args.loss=='TLA' and args.mining=='all' else 256 # all triplets: O(B^3)
+        atk=atk_helper(args,model,eps)
+    return main(args,model,atk)
+
+def distill(args,dataset,teachers,students):
+    """
+    Train each student backbone (PL, same C/D/distances) from each trained PL teacher through
+    a Distiller; students are saved as PL models named <name>-kd-<teacher>
+    """
+    print('\n','*'*50,'\nDistillation start.\n')
+    args.loss,args.evaluate,name='PL',False,args.name
+    for d in dataset:
+        if d=='mnist': continue # the MNIST models are all ConvNet
+        print('===================== Dataset: '+d+' =====================')
+        args.dataset=d
+        args.epochs=200
+        for t in teachers:
+            args.model,args.name=t,name
+            teacher=model_loader(args,model_helper(args),eval=True,best=args.best)
+            cache_path=os.path.join(args.save_dir,'PL',args.group,d,name_helper(args)+'_teacher.npy') # shared by the students
+            checkpoint=best_path(args,args.best)
+            for s in students:
+                if s in ['conv',t]: continue # ConvNet only takes 1x28x28 inputs
+                print('+----------------------- Teacher: '+t+' | Student: '+s+' --------------------+')
+                args.model,args.name=s,name+'-kd-'+t
+                student=share_prototypes(model_helper(args),teacher)
+                if args.compile: student=compile_model(student,args.compile)
+                distiller=Distiller(teacher,cache_path,args.kd_temp,args.kd_alpha,args.kd_beta,checkpoint)
+                best=main(args,student,None,distiller)
+                if logger: logger.record(name_helper(args),None,'kd/best_prec1',best)
+        args.name=name
+
+def sweep_job(kind,job_args,logpath,*rest):
+    """One (dataset, backbone, loss) step of the sweep, run in a scheduler worker"""
+    global args,logger
+    args=job_args
+    logger=RunLogger(logpath,'a')
+    try:
+        if kind=='train': trainer(args,[args.loss],[args.dataset],[args.model])
+        elif kind=='ar': AR_test(rest[0],[args.loss],[args.dataset],[args.model])
+        elif kind=='ood': OOD_test(rest[0],[args.loss],[args.dataset],[args.model])
+    finally: logger.close()
+
+def sweep_jobs(args,losses,dataset,backbones,atks,ood_dataset,logprefix,threads=1):
+    """Expand the trainer/AR_test/OOD_test loops into jobs: train -> AR test -> OOD test"""
+    jobs=[]
+    for d in dataset:
+        backbone=['conv'] if d=='mnist' else [m for m in backbones if m!='conv']
+        for m in backbone:
+            for i in losses:
+                job_args=copy.deepcopy(args)
+                job_args.dataset,job_args.model,job_args.loss=d,m,i
+                name=d+'-'+m+'-'+i
+                logpath=logprefix+'_'+name+'.log'
+                jobs.append(Job('train:'+name,sweep_job,('train',job_args,logpath),threads=threads))
+                jobs.append(Job('ar:'+name,sweep_job,('ar',job_args,logpath,atks),['train:'+name],threads))
+                if d!='mnist': 
+                    jobs.append(Job('ood:'+name,sweep_job,('ood',job_args,logpath,ood_dataset),['ar:'+name],threads))
+    return jobs
+
+def halving_configs(args,losses,dataset,backbones,grid):
+    """{name: args} for every dataset x backbone x loss x grid combination, e.g. grid={'C':[1,3],'D':[128,256]}"""
+    configs={}
+    keys=list(grid)
+    combos=[[]]
+    for k in keys: combos=[c+[v] for c in combos for v in grid[k]]
+    for d in dataset:
+        backbone=['conv'] if d=='mnist' else [m for m in backbones if m!='conv']
+        for m in backbone:
+            for i in losses:
+                for c in combos:
+                    job_args=copy.deepcopy(args)
+                    job_args.dataset,job_args.model,job_args.loss=d,m,i
+                    tag=''.join('-'+k+'_'.join(map(str,v if isinstance(v,(list,tuple)) else [v])) for k,v in zip(keys,c))
+                    for k,v in zip(keys,c): setattr(job_args,k,copy.deepcopy(v))
+                    job_args.name=args.name+tag # separate checkpoints for every config
+                    configs[d+'-'+m+'-'+i+tag]=job_args
+    return configs
+
+def feature_sweep(args,losses,dataset,backbones,grid):
+    """
+    Head-only sweep on frozen backbones. Per dataset and backbone, the backbone of the trained
+    args.feature_source model runs once over the training set (args.feature_views passes, the
+    first unaugmented) and the test set into FeatureCaches; then EmbedLayer + head of every
+    loss x grid config (see halving_configs) train side by side on the cached features, each
+    batch going through all heads. No AT: attacks need the pixel-space backbone.
+    """
+    print('\n','*'*50,'\nFeature cache sweep start.\n')
+    configs=halving_configs(args,losses,dataset,backbones,grid)
+    for d in dataset:
+        if d=='mnist': args.epochs=10;backbone=['conv']
+        else: args.epochs=200;backbone=[m for m in backbones if m!='conv']
+        for m in backbone:
+            src=copy.deepcopy(args)
+            src.dataset,src.model,src.loss,src.AT,src.distill=d,m,args.feature_source,False,False
+            train_loader,val_loader=data_helper(src)
+            net=model_loader(src,model_helper(src),eval=True,best=args.best).net
+            feature_dir=os.path.join(args.save_dir,'features',d)
+            if not os.path.exists(feature_dir): os.makedirs(feature_dir)
+            prefix=os.path.join(feature_dir,name_helper(src))
+            x=next(iter(val_loader))[0][:2]
+            with torch.no_grad(): d_f=net.eval()(x.cuda()).shape[1]
+            caches=[]
+            for split,loader,views in [('train',train_loader,args.feature_views),('val',val_loader,1)]:
+                n=len(loader.data) if isinstance(loader,TensorLoader) else len(loader.dataset)
+                cache=FeatureCache(prefix+'_features_'+split+'.npy',n,d_f,views,split=='val' or args.ratio==1,
+                                   source_key(best_path(src,args.best))) # a retrained source rebuilds it
+                if cache.ready: print('=> features from',cache.path)
+                else: 
+                    print('=> caching features to',cache.path)
+                    cache.build(net,loader)
+                caches.append(cache)
+            del net
+            device=args.tensor_device
+            train_features=FeatureLoader(caches[0],args.batch_size,True,device)
+            val_features=FeatureLoader(caches[1],args.batch_size,False,device)
+
+            cfgs={n:a for n,a in configs.items() if a.dataset==d and a.model==m}
+            heads={n:head_model(model_helper(a)) for n,a in cfgs.items()}
+            optimizers={n:torch.optim.SGD(h.parameters(),args.lr,momentum=args.momentum,weight_decay=args.weight_decay) 
+                        for n,h in heads.items()}
+            epochs=args.feature_epochs
+            schedulers={n:torch.optim.lr_scheduler.MultiStepLR(o,milestones=[epochs//2,epochs*3//4]) for n,o in optimizers.items()}
+            best={n:0 for n in heads}
+            for epoch in range(epochs):
+                te=time.time()
+                stats=train_heads(cfgs,heads,optimizers,train_features)
+                for n,h in heads.items():
+                    schedulers[n].step()
+                    prec1=validate(cfgs[n],val_features,h)
+                    if logger: 
+                        logger.log(n,epoch,train_loss=stats[n][0],train_prec1=stats[n][1])
+                        logger.record(n,epoch,'val_prec1',prec1)
+                    if prec1>best[n]:
+                        best[n]=prec1
+                        atomic_save({'state_dict': h.state_dict()},prefix+'_'+n+'_head_best.th')
+                print('Features epoch',epoch+1,'/',epochs,'(',len(heads),'heads ) time:',time.time()-te)
+            msg='\n===================== Feature cache | Dataset: '+d+' | Backbone: '+m+' =====================\n'
+            msg+=table_msg(['prec1'],[(n,{'prec1':best[n]}) for n in heads])
+            print(msg)
+            if logger: logger.info(msg)
+
+def train_heads(configs,heads,optimizers,loader):
+    """one epoch of every head on the same batches, {name: (loss, prec1)}"""
+    sums={n:[0,0] for n in heads}
+    count=0
+    for h in heads.values(): h.train()
+    for input,target in loader:
+        input,target=input.cuda(),target.cuda()
+        first=input.clone() if count==0 else None
+        count+=input.size(0)
+        for n,h in heads.items():
+            output,loss,_=loss_helper(configs[n],h,input,target)
+            optimizers[n].zero_grad()
+            loss.backward()
+            optimizers[n].step()
+            sums[n][0]+=loss.detach()*input.size(0) # no host sync per step
+            sums[n][1]+=(output.detach().argmax(1)==target).sum()
+        if first is not None: assert torch.equal(input,first),'a head modified the shared feature batch in place'
+    return {n:(float(l)/count,100*float(c)/count) for n,(l,c) in sums.items()}
+
+def halving_job(name,job_args,budget):
+    """train one config up to `budget` epochs, continuing from its checkpoint"""
+    global args
+    args=job_args
+    args.epochs,args.resume,args.evaluate=budget,True,False
+    args.eps=0.3 if args.dataset=='mnist' else 8/255
+    print('Halving: {} -> {} epochs'.format(name,budget))
+    return train_config(args,args.eps)
+
+def checkpoint_score(name,job_args):
+    """best prec1+robust recorded in the config's checkpoint"""
+    save_dir=os.path.join(job_args.save_dir, 'PL') if job_args.loss=='PL' else job_args.save_dir
+    save_dir=os.path.join(save_dir, job_args.group, job_args.dataset)
+    checkpoint=torch.load(os.path.join(save_dir, name_helper(job_args)+'_checkpoint.th'),map_location='cpu')
+    return checkpoint['best_prec1']
 
 
 if __name__ == '__main__':
@@ -479,20 +1020,97 @@ if __name__ == '__main__':
     parser.add_argument('--atk', type=str,  default=None, help='atk')
     parser.add_argument('--C', type=int,  default=1, help='number of prototypes')
     parser.add_argument('--D', type=int,  default=64, help='d_model')
+    parser.add_argument('--mining', type=str,  default='all', 
+                        help='TLA triplet mining: all, batch_hard or semi_hard (O(B^2), batch 256)')
+    parser.add_argument('--proxy-mode', dest='proxy_mode', type=str, default='anchor', 
+                        help='PXA: anchor (Proxy-Anchor) or nca (Proxy-NCA), C proxies per class')
+    parser.add_argument('--xbm', type=int, default=0, 
+                        help='TLA/NLA: cross-batch memory of this many embeddings (0: off, TLA needs --mining other than all)')
+    parser.add_argument('--pk-classes', dest='pk_classes', type=int, default=0, 
+                        help='TLA/NLA: batches of P classes x K samples (0: random batches)')
+    parser.add_argument('--pk-samples', dest='pk_samples', type=int, default=4, 
+                        help='TLA/NLA: K samples per class in a P x K batch')
     parser.add_argument('--lossdist', type=str,  default='L2', help='loss distance metric')
     parser.add_argument('--normdist', type=str,  default='L2', help='norm distance metric')
     parser.add_argument('--preddist', type=str,  default='L2', help='pred distance metric')
     parser.add_argument('--adv_norm', type=bool,  default=True, help='seperate adv norm term')
     parser.add_argument('--ploption', type=list,  default=[0.1,0.1], help='[a,b]')
     parser.add_argument('--AT', type=bool,  default=False, help='use adversarial training')
+    parser.add_argument('--at-mode', dest='at_mode', type=str,  default='pgd', 
+                        help='pgd: args.atk every step, free: replayed FGSM, fast: FGSM-RS, '
+                             'cache: PGD warm-started from last epoch')
+    parser.add_argument('--replays', type=int,  default=4, 
+                        help='minibatch replays of free AT (each replay is one SGD step, so epochs and LR milestones are divided by it)')
+    parser.add_argument('--eps', type=float,  default=8/255, help='perturbation budget')
+    parser.add_argument('--cache-steps', dest='cache_steps', type=int,  default=2, 
+                        help='PGD steps from the cached perturbation (at_mode cache)')
+    parser.add_argument('--cache-dtype', dest='cache_dtype', type=str,  default='int8', 
+                        help='int8 or fp16 storage of cached perturbations')
+    parser.add_argument('--cache-mmap', dest='cache_mmap', type=bool,  default=False, 
+                        help='memory-map the perturbation cache next to the checkpoint')
     parser.add_argument('--max_best', type=int,  default=3, help='max_best')
+    parser.add_argument('--async-save', dest='async_save', type=bool,  default=True, 
+                        help='write checkpoints from a background thread')
+    parser.add_argument('--best-fp16', dest='best_fp16', type=bool,  default=False, 
+                        help='store _bestN.th weights in fp16')
     parser.add_argument('--best', type=int,  default=1, help='load which best')
+    parser.add_argument('--compile', default='', type=str,
+                        help='torch.compile mode for training (default, reduce-overhead, max-autotune), '
+                        'AR_table evaluates TorchScript traces; empty for eager')
+    parser.add_argument('--freeze', type=bool, default=False,
+                        help='OOD test on BN-folded channels_last copies of the models')
+    parser.add_argument('--ptq', type=bool, default=False,
+                        help='int8 post-training quantization report after the OOD test')
+    parser.add_argument('--calib-batches', dest='calib_batches', default=8, type=int,
+                        help='training batches used to calibrate the int8 observers / rank channels by gradient')
+    parser.add_argument('--prune', type=bool, default=False,
+                        help='structured channel pruning report after the OOD test')
+    parser.add_argument('--prune-ratios', dest='prune_ratios', nargs='+', type=float, default=[0.3,0.5,0.7],
+                        help='fractions of the conv channels removed')
+    parser.add_argument('--prune-criterion', dest='prune_criterion', default='bn', type=str,
+                        help='channel ranking: bn (BN scale) or grad (Taylor saliency)')
+    parser.add_argument('--prune-epochs', dest='prune_epochs', default=10, type=int,
+                        help='fine-tuning epochs after pruning')
+    parser.add_argument('--prune-lr', dest='prune_lr', default=1e-3, type=float,
+                        help='fine-tuning learning rate')
+    parser.add_argument('--distill', type=bool, default=False,
+                        help='distill the trained PL backbones into the students instead of the usual sweep')
+    parser.add_argument('--kd-temp', dest='kd_temp', default=4, type=float,
+                        help='softmax temperature of the distance distillation term')
+    parser.add_argument('--kd-alpha', dest='kd_alpha', default=1, type=float,
+                        help='weight of the embedding MSE term')
+    parser.add_argument('--kd-beta', dest='kd_beta', default=1, type=float,
+                        help='weight of the distance KL term')
+    parser.add_argument('--feature-cache', dest='feature_cache', type=bool, default=False,
+                        help='sweep heads (EmbedLayer + loss) on cached features of a frozen backbone')
+    parser.add_argument('--feature-source', dest='feature_source', default='PL', type=str,
+                        help='trained model (loss) whose backbone produces the cached features')
+    parser.add_argument('--feature-views', dest='feature_views', default=1, type=int,
+                        help='passes over the training set to cache, all but the first augmented')
+    parser.add_argument('--feature-epochs', dest='feature_epochs', default=30, type=int,
+                        help='head training epochs on the cached features')
+    parser.add_argument('--val-subset', dest='val_subset', default=0, type=int,
+                        help='validate on a fixed stratified subset of N images (0: full set)')
+    parser.add_argument('--val-every', dest='val_every', default=1, type=int,
+                        help='validate every N epochs (always at the last one)')
+    parser.add_argument('--val-full', dest='val_full', type=bool, default=False,
+                        help='with --val-subset, rerun on the full set when the subset score improves')
+    parser.add_argument('--robust-val', dest='robust_val', default='sync', type=str,
+                        help='sync or async: robust validation in a background process from epoch snapshots')
+    parser.add_argument('--eps-factors', dest='eps_factors', type=float, nargs='+', default=[0.5,1,2], 
+                        help='AR tests: npgd/pgdd attack every multiple of the dataset eps in one batched run')
+    parser.add_argument('--single-pass', dest='single_pass', type=bool,  default=False, 
+                        help='AR_test: load each checkpoint once and run all attacks per batch')
     parser.add_argument('--dataset', type=str,  default='mnist', help='dataset')
     parser.add_argument('-j', '--workers', default=5, type=int, metavar='N',
                         help='number of data loading workers (default: 4)')
     parser.add_argument('--epochs', default=10, type=int, metavar='N',
                         help='number of total epochs to run')
     parser.add_argument('--ratio', default=1.0, type=float, help='training data ratio')
+    parser.add_argument('--tensor-data', dest='tensor_data', type=list, default=[], 
+                        help='datasets loaded as in-memory tensors with batched augmentation')
+    parser.add_argument('--tensor-device', dest='tensor_device', type=str, default='cuda', 
+                        help='device holding the tensor datasets (cpu prefetches in a thread)')
     parser.add_argument('--start-epoch', default=0, type=int, metavar='N',
                         help='manual epoch number (useful on restarts)')
     parser.add_argument('--batch-size', default=256, type=int,
@@ -502,6 +1120,8 @@ if __name__ == '__main__':
     parser.add_argument('--momentum', default=0.9, type=float, metavar='M', help='momentum')
     parser.add_argument('--weight-decay', '--wd', type=float, default=1e-4,
                         metavar='W', help='weight decay (default: 1e-4)')
+    parser.add_argument('--profile', type=bool, default=False,
+                        help='phase timers with per-epoch summary and Chrome trace export (CUDA synced at phase boundaries)')
     parser.add_argument('--print-freq', '-p', type=int, default=50,
                         metavar='N', help='print frequency (default: 50)')
     parser.add_argument('--resume', type=bool,  default=True,
@@ -514,6 +1134,16 @@ if __name__ == '__main__':
                         help='The directory used to save the trained models', type=str)
     parser.add_argument('--save-every', dest='save_every', default=10,
                         help='Saves checkpoints at every specified number of epochs', type=int)
+    parser.add_argument('--halving', type=bool, default=False,
+                        help='successive halving over the sweep configs instead of full training')
+    parser.add_argument('--halving-eta', dest='halving_eta', type=int, default=3,
+                        help='keep the top 1/eta configs at every rung')
+    parser.add_argument('--halving-min-epochs', dest='halving_min_epochs', type=int, default=5,
+                        help='lower bound on the epochs of the first rung')
+    parser.add_argument('--sweep-workers', dest='sweep_workers', default=0, type=int,
+                        help='run the sweep as a parallel resumable job graph with N processes')
+    parser.add_argument('--sweep-threads', dest='sweep_threads', default=1, type=int,
+                        help='torch threads per sweep job')
     args = parser.parse_args()
 
 
@@ -531,6 +1161,7 @@ if __name__ == '__main__':
     args.batch_size=256
     args.lr=1e-2
     args.ratio=1.0 # For FSL
+    args.tensor_data=[] # e.g. ['cifar','svhn','mnist'], skip PIL transforms and workers
     
     args.adv_norm=True # use a seperate adv norm term
     args.C=1
@@ -539,9 +1170,11 @@ if __name__ == '__main__':
     args.normdist='L2'
     args.preddist='L2'
     args.ploption=[0.1,0.2] # a,b
+    args.at_mode='pgd' # 'free'/'fast' reuse training gradients, 'cache' warm-starts PGD
 
     # backbones=['resnet','vgg','conv','mobilenet']
     backbones=['resnet']
+    students=['mobilenet'] # distillation targets of the backbones
     # losses=['PL','vanilla','DCE','TLA','NLA']
     losses=['PL']
     # dataset=['mnist','cifar','svhn']
@@ -552,26 +1185,59 @@ if __name__ == '__main__':
 
     args.resume=True
     args.evaluate=False
+    if args.profile: prof.enable(sync=True) # on CUDA, charge async kernels to the phase that launched them
     
     logdir='../nips/PL/logs/'
     if not os.path.exists(logdir): os.makedirs(logdir)
-    logger=mylogger(logdir+logname+'.log','w')
-
-
-    """ Train """
-    trainer(args,losses,dataset,backbones)
+    logger=RunLogger(logdir+logname+'.log','w') # text log, metric records in logname.jsonl
 
 
-    """ Adversarial Robustness Test """
     atks=['fgsm','pgd','bim','pgdrs','pgdl2']
-    AR_test(atks,losses,dataset,backbones)
-    
-
-    """ OOD Test on a Trained model (w/wo ODIN) """
+    args.single_pass=True # one accuracy/robustness table per dataset and backbone
     ood_dataset=["Imagenet","Imagenet_resize","LSUN","LSUN_resize",
                     "iSUN","Gaussian","Uniform"]
-    OOD_test(ood_dataset,losses,dataset,backbones)
 
+    if args.halving:
+        """ Successive halving: short runs for all configs, survivors resumed to longer budgets """
+        grid={'C':[1,3],'D':[128,256]} # any args fields, one config per combination
+        for d in dataset: # scores are only comparable within one dataset and backbone
+            configs=halving_configs(args,losses,[d],backbones,grid)
+            max_epochs=10 if d=='mnist' else 200
+            for m in sorted({c.model for c in configs.values()}):
+                pool={n:c for n,c in configs.items() if c.model==m}
+                SuccessiveHalving(pool,halving_job,checkpoint_score,args.halving_min_epochs,max_epochs,args.halving_eta,
+                    state=logdir+logname+'_halving_'+d+'-'+m+'.json').run(args.sweep_workers,args.sweep_threads)
+
+    elif args.feature_cache:
+        """ Head sweep: every loss x grid config trained on cached features of a frozen backbone """
+        grid={'C':[1,3],'D':[128,256]} # head fields only: C, D, ploption, lossdist/normdist/preddist
+        feature_sweep(args,losses,dataset,backbones,grid)
+
+    elif args.distill:
+        """ Distillation: trained PL teachers -> small PL students on cached teacher outputs """
+        distill(args,dataset,backbones,students)
+
+    elif args.sweep_workers:
+        """ Parallel sweep: train -> AR test -> OOD test per config, finished jobs are skipped on restart """
+        jobs=sweep_jobs(args,losses,dataset,backbones,atks,ood_dataset,logdir+logname,args.sweep_threads)
+        Scheduler(jobs,args.sweep_workers,state=logdir+logname+'_sweep.json').run()
+
+    else:
+        """ Train """
+        trainer(args,losses,dataset,backbones)
+
+
+        """ Adversarial Robustness Test """
+        AR_test(atks,losses,dataset,backbones)
+        
+
+        """ OOD Test on a Trained model (w/wo ODIN) """
+        OOD_test(ood_dataset,losses,dataset,backbones)
+
+
+        """ Int8 PTQ: accuracy, robustness, OOD, latency and size of the quantized models """
+        if args.ptq: PTQ_test(atks,ood_dataset,losses,dataset,backbones)
 
 
-    
\ No newline at end of file
+        """ Structured channel pruning: fine-tuned accuracy vs FLOPs, latency and size """
+        if args.prune: prune_test(losses,dataset,backbones)
@@ -16,8 +16,10 @@ from IL.data_loader import iCIFAR10, iCIFAR100
 from IL.model import *
 from ML.triplet_margin_loss import TripletMarginLoss as TML
 from ML.n_pairs_loss import NPairsLoss as NPL
+from ML.proxy_loss import ProxyLoss
 from pytorch_metric_learning import distances
 from OOD.cal import testood
+from profiling import prof
 import torchattacks
 
 
@@ -75,6 +77,7 @@ def model_helper(args):
     elif args.loss=='dce': return DCENet(2048, 1, args.learning_rate)
     elif args.loss=='tla': return MLNet(2048, 1, args.learning_rate, TML())
     elif args.loss=='nla': return MLNet(2048, 1, args.learning_rate, NPL())
+    elif args.loss=='pxa': return MLNet(2048, 1, args.learning_rate, ProxyLoss(10, 2048)) # proxies of all 10 classes
     elif args.loss=='pl': return PLNet(2048, 1, args.learning_rate, dist_helper(args.dist))
 
 def main(model,args,attack=None):
@@ -112,6 +115,10 @@ def main(model,args,attack=None):
             if do_class:
                 print('********** Update **********')
                 model.update_representation(train_set,args,attack)
+                if prof.enabled: 
+                    print(prof.summary())
+                    prof.export_chrome(os.path.join(save_dir, args.name+'_class'+str(s)+'_trace.json'))
+                    prof.reset()
             else: print('********** Class trained **********')
             args.start_epoch=0
 
@@ -177,6 +184,10 @@ if __name__ == '__main__':
     parser.add_argument('--loss', type=str,  default='', help='loss')
     parser.add_argument('--dist', type=str,  default='dotproduct', help='distance metric')
     parser.add_argument('--AT', type=bool,  default=False, help='use adversarial training')
+    parser.add_argument('--pk-classes', dest='pk_classes', type=int, default=0, 
+                        help='ML losses: batches of P classes x K samples (0: random batches)')
+    parser.add_argument('--pk-samples', dest='pk_samples', type=int, default=4, 
+                        help='ML losses: K samples per class in a P x K batch')
     parser.add_argument('--num_classes', default=1, type=int, help='new classes num')
     parser.add_argument('--K', default=2000, type=int, help='total number of exemplars')
     parser.add_argument('--num_workers', default=0, type=int, metavar='N',
@@ -198,6 +209,8 @@ if __name__ == '__main__':
                         help='evaluate model on validation set')
     parser.add_argument('--save-dir', dest='save_dir', default='save_temp',
                         help='The directory used to save the trained models', type=str)
+    parser.add_argument('--profile', type=bool, default=False,
+                        help='phase timers with summary and Chrome trace export per class increment (CUDA synced at phase boundaries)')
     args = parser.parse_args()
 
 
@@ -214,6 +227,7 @@ if __name__ == '__main__':
     args.dist='dotproduct' # only for PL
     args.evaluate=False
     args.resume=False
+    if args.profile: prof.enable(sync=True) # on CUDA, charge async kernels to the phase that launched them
     model = model_helper(args).cuda()
 
 
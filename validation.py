@@ -0,0 +1,107 @@
+import copy
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import torch
+
+from data_utils import TensorLoader
+
+
+""" Validation policy: subset / periodic / deferred validation with best-model selection """
+
+def loader_targets(loader):
+    if isinstance(loader,TensorLoader): return loader.targets.cpu().numpy()
+    d=loader.dataset
+    return np.asarray(d.labels if hasattr(d,'labels') else d.targets)
+
+def stratified_indices(targets,n,seed=0):
+    """n indices with every class represented in proportion to its frequency, fixed by seed"""
+    targets=np.asarray(targets)
+    rng=np.random.RandomState(seed)
+    idx=[]
+    classes,counts=np.unique(targets,return_counts=True)
+    for c,k in zip(classes,counts):
+        take=max(1,int(round(n*k/len(targets))))
+        idx.append(rng.choice(np.flatnonzero(targets==c),min(take,k),replace=False))
+    return np.sort(np.concatenate(idx))
+
+def subset_loader(loader,indices):
+    """the same loader restricted to indices"""
+    if isinstance(loader,TensorLoader):
+        sub=copy.copy(loader)
+        idx=torch.as_tensor(indices,device=loader.data.device)
+        sub.data,sub.targets=loader.data[idx],loader.targets[idx]
+        return sub
+    return torch.utils.data.DataLoader(torch.utils.data.Subset(loader.dataset,indices),
+        batch_size=loader.batch_size, shuffle=False, num_workers=loader.num_workers, pin_memory=loader.pin_memory)
+
+class ValidationPolicy:
+    """
+    When and on what data trainer.main validates.
+        subset: validate on a fixed stratified subset of this size (0: full set)
+        every: validate every N epochs and at the last one
+        full_on_improve: with a subset, rerun on the full set only when the subset score
+            improves; selection (is_best) is then on full-set scores
+    The score is prec1+robust as for best_prec1; best is the best score so far.
+    """
+    def __init__(self,loader,subset=0,every=1,full_on_improve=False,best=0,seed=0):
+        self.full_loader=loader
+        self.indices=stratified_indices(loader_targets(loader),subset,seed) if subset else None
+        self.loader=subset_loader(loader,self.indices) if subset else loader
+        self.every=max(1,every)
+        self.full_on_improve=full_on_improve and bool(subset)
+        self.best,self.best_subset=best,0
+
+    @property
+    def selection_indices(self):
+        """samples the selection score is measured on, None for the full set"""
+        return None if self.full_on_improve else self.indices
+
+    def due(self,epoch,epochs):
+        return (epoch+1)%self.every==0 or epoch+1==epochs
+
+    def run(self,fn,select=True):
+        """
+        fn(loader) -> (prec1, robust). Returns prec1, robust, whether they were measured on the
+        selection set, and whether they are a new best (only if select, see update()).
+        """
+        prec1,robust=fn(self.loader)
+        if self.full_on_improve:
+            if prec1+robust<=self.best_subset: return prec1,robust,False,False
+            self.best_subset=prec1+robust
+            prec1,robust=fn(self.full_loader)
+        return prec1,robust,True,select and self.update(prec1+robust)
+
+    def update(self,score):
+        if score>self.best:
+            self.best=score
+            return True
+        return False
+
+class RobustValidator:
+    """
+    Robust validation in a background process. submit() hands over a saved state_dict
+    snapshot; the worker rebuilds model, attack and validation data once from `args`
+    (job(args, path, indices) -> robust accuracy) and evaluates the snapshots in order.
+    poll() returns the finished (epoch, prec1, robust, path).
+    """
+    def __init__(self,job,args):
+        self.job,self.args=job,args
+        self.pool=ProcessPoolExecutor(1,mp_context=mp.get_context('spawn'))
+        self.pending=[]
+
+    def submit(self,epoch,prec1,path,indices=None):
+        future=self.pool.submit(self.job,self.args,path,indices)
+        self.pending.append((epoch,prec1,path,future))
+
+    def poll(self,block=False):
+        done=[]
+        while self.pending and (block or self.pending[0][3].done()): # in submission order
+            epoch,prec1,path,future=self.pending.pop(0)
+            done.append((epoch,prec1,future.result(),path))
+        return done
+
+    def close(self):
+        done=self.poll(block=True)
+        self.pool.shutdown()
+        return done
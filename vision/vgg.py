@@ -44,17 +44,41 @@ class VGG(nn.Module):
             nn.Dropout(),
             nn.Linear(4096, num_classes),
         )
+        self.fold_pool = True # 1x1 feature maps skip the pool, see _folded_weight
+        self._fold_key, self._fold_cache = None, None
         if init_weights:
             self._initialize_weights()
 
     def forward(self, x: torch.Tensor, pred=False) -> torch.Tensor:
         x = self.features(x)
-        x = self.avgpool(x)
-        x = torch.flatten(x, 1)
-        x=self.lin(x)
+        if self.fold_pool and not _is_fx_tracing() and x.shape[-2:] == (1, 1):
+            # 32x32 inputs: the 7x7 pool only replicates each channel 49 times
+            x = torch.flatten(x, 1)
+            x = self.lin[1:](nn.functional.linear(x, self._folded_weight(), self.lin[0].bias))
+        else:
+            x = self.avgpool(x)
+            x = torch.flatten(x, 1)
+            x=self.lin(x)
         if pred: x = self.classifier(x)
         return x
 
+    def _folded_weight(self) -> torch.Tensor:
+        """
+        lin[0] weight for a 1x1 feature map: the 49 columns that see copies of the same channel
+        summed, (4096, 512*49) -> (4096, 512). Built from the live weight in every forward while
+        it needs grad, so training updates lin[0] exactly as on the 7x7 path, and while tracing,
+        so a torch.jit trace records the fold instead of a cached constant; otherwise cached
+        until the weight changes (in-place updates bump its version).
+        """
+        w = self.lin[0].weight
+        if torch.jit.is_tracing() or (torch.is_grad_enabled() and w.requires_grad):
+            return w.view(w.size(0), -1, 49).sum(2)
+        key = (w.data_ptr(), w._version, w.device, w.dtype)
+        if self._fold_key != key:
+            self._fold_cache = w.detach().view(w.size(0), -1, 49).sum(2)
+            self._fold_key = key
+        return self._fold_cache
+
     def _initialize_weights(self) -> None:
         for m in self.modules():
             if isinstance(m, nn.Conv2d):
@@ -69,6 +93,13 @@ class VGG(nn.Module):
                 nn.init.constant_(m.bias, 0)
 
 
+def _is_fx_tracing() -> bool:
+    # FX symbolic tracing can't branch on shapes, it takes the plain 7x7 path
+    fx = getattr(torch.fx, '_symbolic_trace', None)
+    is_tracing = getattr(fx, 'is_fx_symbolic_tracing', None) or getattr(fx, 'is_fx_tracing', None)
+    return is_tracing is not None and is_tracing()
+
+
 def make_layers(cfg: List[Union[str, int]], batch_norm: bool = False) -> nn.Sequential:
     layers: List[nn.Module] = []
     in_channels = 3
@@ -122,7 +122,7 @@ class ConvNet(nn.Module):
         x = self.prelu3_1(self.bn3_1(self.conv3_1(x)))
         x = self.prelu3_2(self.bn3_2(self.conv3_2(x)))
         x = F.max_pool2d(x, 2)
-        x= x.view(-1, 128 * 3 * 3)
+        x= x.reshape(-1, 128 * 3 * 3)
         return x
 
 
@@ -137,7 +137,7 @@ class dce_loss(torch.nn.Module):
         super(dce_loss, self).__init__()
         self.K=K
         self.feat_dim=feat_dim
-        self.centers=nn.Parameter(torch.randn(self.feat_dim,self.K).cuda(),requires_grad=True)
+        self.centers=nn.Parameter(torch.randn(self.feat_dim,self.K),requires_grad=True) # moved with the model
         if init_weight: nn.init.kaiming_normal_(self.centers)
     def forward(self, x):
         features_square=torch.sum(torch.pow(x,2),1, keepdim=True)
@@ -159,6 +159,24 @@ def dist_helper(dist):
     elif dist=='L2': return distances.LpDistance(power=2)
     elif dist=='Linf': return distances.LpDistance(power=float('inf'))
 
+def plain_distance(dist,x,y):
+    """
+    dist(x, y) of a dist_helper distance with plain normalize/matmul/reduce ops, for graph
+    exporters that can't trace the pytorch_metric_learning objects (same normalize, p, power)
+    """
+    if dist.normalize_embeddings: x,y=F.normalize(x,p=dist.p,dim=1),F.normalize(y,p=dist.p,dim=1)
+    if isinstance(dist,distances.DotProductSimilarity): mat=torch.matmul(x,y.t())
+    elif dist.p==2:
+        sq=(x*x).sum(1,keepdim=True)+(y*y).sum(1)[None]-2*torch.matmul(x,y.t())
+        sq=sq.clamp_min(0)
+        if dist.power==2: return sq
+        mat=sq.sqrt()
+    else:
+        diff=(x[:,None,:]-y[None]).abs()
+        mat=diff.amax(-1) if dist.p==float('inf') else diff.pow(dist.p).sum(-1).pow(1/dist.p)
+    if dist.power!=1: mat=mat**dist.power
+    return mat
+
 class PL(nn.Module):
     def __init__(self,C=2,D=64,lossdist='L2',normdist='L2',preddist='L2',K=10):
         super(PL, self).__init__()
@@ -186,7 +204,8 @@ class PL(nn.Module):
         plloss=pl_loss(y,distance,self.K)+a*plnorm
         if x_adv is not None:
             advdist=self.norm_dist(x_adv,self.embeds)
-            advnorm=pl_norm(y,advdist,self.K)
+            advdist=advdist.reshape(-1,self.C,self.K).mean(1)
+            advnorm=pl_norm(y,advdist)
             plloss+=b*advnorm
         return plloss
 